@@ -9,11 +9,39 @@ contract Lottery is VRFConsumerBase, Ownable {
     // here we're inheriting "VRFConsumerBase", "Ownable" into our "Lottery" contract
     // here we're going to need to keep the track of all the different players(i.e everybody who signsup for this lottery)...
     // ...So for this we need to make address payable
-    address payable[] public players;
+    // Every purchase is stored once, however many tickets it buys, together with the running total of tickets sold so far.
+    // "address" (20 bytes) + "uint96" (12 bytes) fit in a single storage slot, so a purchase costs one SSTORE.
+    struct Entry {
+        address payable player;
+        uint96 cumulativeTickets; // tickets sold up to and including this purchase
+    }
+    // "recentWinner" (20 bytes), "lottery_state" (1 byte), the round number (6 bytes) and the round's start time (5 bytes)
+    // share a single storage slot, so "enter()" reads the state and the round with one SLOAD and "fulfillRandomness()"
+    // closes a round by writing one slot.
     address payable public recentWinner;
+    // Now creating a variable type "LOTTERY_STATE"
+    LOTTERY_STATE public lottery_state;
+    // Entries are keyed by round, so closing a round is just moving on to the next "lotteryRound" instead of clearing storage,
+    // which costs the same whether the round had 3 players or 30,000, and past rounds stay readable.
+    uint48 internal currentRound; // read through "lotteryRound()", which still returns a uint256
+    uint40 public roundStartedAt; // when "startLottery()" (or "performUpkeep()") opened the current round
+    mapping(uint256 => mapping(uint256 => Entry)) public entries; // round => purchase index => entry
+    mapping(uint256 => uint256) public entryCount; // round => number of purchases
     uint256 public randomness; // for keeping track of the most recent random number
-    uint256 public usdEntryFee;
-    AggregatorV3Interface internal ethUsdPriceFeed; // used pulling code from "https://docs.chain.link/docs/get-the-latest-price/"
+    // Values that never change after deployment are "immutable": they're stored in the contract's code instead of storage,
+    // so reading them costs a PUSH instead of an SLOAD and the getters below stay exactly the same.
+    uint256 public immutable usdEntryFee;
+    AggregatorV3Interface public immutable ethUsdPriceFeed; // used pulling code from "https://docs.chain.link/docs/get-the-latest-price/"
+    // The entrance fee is cached per price-feed round, so "enter()" doesn't have to call into the price feed for every ticket.
+    // Within "feeCacheTtl" seconds of the last feed read we trust the cached fee without reading the feed at all,
+    // after that we read the feed again and only recompute the fee if its "roundId"/"updatedAt" has changed.
+    uint256 public immutable feeCacheTtl;
+    // "uint96" + "uint80" + 2 x "uint40" fit in a single storage slot. Even at an ETH price of $0.00000001 the fee of
+    // $50 is below 2**96 wei, and "uint40" timestamps last until the year 36812.
+    uint96 public cachedEntranceFee;
+    uint80 public cachedFeedRoundId;
+    uint40 public cachedFeedUpdatedAt;
+    uint40 public entranceFeeCheckedAt;
     // for making sure that, we're not ending the lottery before the lottery even starts or we're not enteriing a lottery when a lottery hesn't even begun...
     // ...So we're going to want a way to iterate through the differet phases of this lottery and for that we can do "enum"...
     // ...we can read more about "enum" in the solidity documentation here:-"https://docs.soliditylang.org/en/v0.8.10/types.html")
@@ -22,11 +50,39 @@ contract Lottery is VRFConsumerBase, Ownable {
         CLOSED,
         CALCULATING_WINNER
     }
-    // Now creating a variable type "LOTTERY_STATE"
-    LOTTERY_STATE public lottery_state;
-    uint256 public fee; // It is associated to LINK token needed to pay for the request. It changes from blockchain to blockchain so we will use it as an input parametrs as well in our "constructor()"
-    bytes32 public keyhash; // It is a way to uniquely identify the Chainlink_VRF Node
+    uint256 public immutable fee; // It is associated to LINK token needed to pay for the request. It changes from blockchain to blockchain so we will use it as an input parametrs as well in our "constructor()"
+    bytes32 public immutable keyhash; // It is a way to uniquely identify the Chainlink_VRF Node
+    // Chainlink Keepers compatible automation: "checkUpkeep()"/"performUpkeep()" below have the signatures of
+    // "KeeperCompatibleInterface", we just don't import it. Once the owner has started the first round, a round is ended
+    // when it has been open for "roundDuration" seconds with at least "minPlayers" purchases (and the LINK to pay for
+    // the randomness), and the next round is started as soon as the previous one has been paid out.
+    uint256 public immutable roundDuration; // 0 turns the automation off
+    uint256 public immutable minPlayers;
+    enum UPKEEP_ACTION {
+        NONE,
+        START,
+        END
+    }
     event RequestedRandomness(bytes32 requestId);
+    // emitted from "fulfillRandomness()" so off-chain code can match the callback against the "requestId" above instead of sleeping and polling "recentWinner"
+    event RandomnessFulfilled(
+        bytes32 indexed requestId,
+        address indexed winner,
+        uint256 randomness
+    );
+    // entry and payout history, so indexers can rebuild every round from logs instead of reading "players(round, i)" one by one
+    event LotteryEntered(
+        uint256 indexed round,
+        address indexed player,
+        uint256 tickets,
+        uint256 cumulativeTickets
+    );
+    event WinnerPaid(
+        uint256 indexed round,
+        address indexed winner,
+        uint256 amount,
+        uint256 randomness
+    );
 
     // So, now we've identified a new type of event called "RequestedRandomness()" it's really similar to the "enum" in this regard.
     // So to emit one of these events all we have to do in our "endLottery()" bid is we'll do "emit RequestedRandomness(requestId);" which we can see below
@@ -40,7 +96,10 @@ contract Lottery is VRFConsumerBase, Ownable {
         address _vrfCoordinator,
         address _link, // as we want to pass the address of our price feed as a contructor parameter and some more parameters for making it similar to "VRFConsumerBase()" parameters, finally using inherited constructor from "VRFConsumerBase()" to use it's parameter also
         uint256 _fee,
-        bytes32 _keyhash
+        bytes32 _keyhash,
+        uint256 _feeCacheTtl, // how many seconds the cached entrance fee is trusted without re-reading the price feed
+        uint256 _roundDuration, // seconds a round stays open before "performUpkeep()" may end it, 0 for no automation
+        uint256 _minPlayers // purchases a round needs before "performUpkeep()" ends it
     ) public VRFConsumerBase(_vrfCoordinator, _link) {
         //
         usdEntryFee = 50 * (10**18); // in terms of wei
@@ -52,20 +111,171 @@ contract Lottery is VRFConsumerBase, Ownable {
         // we can also write the above line as "lottery_state = 1" as "1" stands for closed
         fee = _fee; // It is associated to LINK token needed to pay for the request.
         keyhash = _keyhash; // It is a way to uniquely identify the Chainlink_VRF Node
+        feeCacheTtl = _feeCacheTtl;
+        roundDuration = _roundDuration;
+        // a round without purchases has no winner, so automation always waits for at least one
+        minPlayers = _minPlayers > 0 ? _minPlayers : 1;
     }
 
     // below is the function for entry of the user and since we want them to pay in ethereum so we're going to need to make this "entry()" payable.
     function enter() public payable {
+        _enter(1);
+    }
+
+    // Buying several tickets at once is a single purchase record, so it costs about the same gas as buying one
+    function enterTickets(uint256 _tickets) public payable {
+        _enter(_tickets);
+    }
+
+    function _enter(uint256 _tickets) internal {
         // $50 minimum and also we have to store this value somewhere(i.e we want to store this value right when our contract is deployed) so we save this in our contructor
         // below code shows that, we can only enter if somebody started this lottery.
         require(lottery_state == LOTTERY_STATE.OPEN);
-        require(msg.value >= getEntranceFee(), "Not enough ETH!"); // checking whether it's greater than the minimum value
-        players.push(msg.sender); // Anytime sombody enters this code help us know that.
+        require(_tickets > 0 && _tickets < 2**64, "Invalid ticket count");
+        uint256 round = currentRound;
+        uint256 count = entryCount[round];
+        uint256 cumulativeTickets = getTotalTickets(round) + _tickets;
+        require(cumulativeTickets <= uint96(-1), "Too many tickets!");
+        require(msg.value >= _refreshEntranceFee() * _tickets, "Not enough ETH!"); // checking whether it's greater than the minimum value
+        entries[round][count] = Entry(msg.sender, uint96(cumulativeTickets)); // Anytime sombody enters this code help us know that.
+        entryCount[round] = count + 1;
+        emit LotteryEntered(round, msg.sender, _tickets, cumulativeTickets);
+    }
+
+    // the player behind the i-th purchase of a round, for the current round use "players(lotteryRound(), i)"
+    function players(uint256 _round, uint256 _index)
+        public
+        view
+        returns (address payable)
+    {
+        require(_index < entryCount[_round], "No such entry");
+        return entries[_round][_index].player;
+    }
+
+    function getTotalTickets(uint256 _round) public view returns (uint256) {
+        uint256 count = entryCount[_round];
+        if (count == 0) {
+            return 0;
+        }
+        return entries[_round][count - 1].cumulativeTickets;
+    }
+
+    // same getter as the old "uint256 public lotteryRound", the round itself is packed next to "recentWinner"
+    function lotteryRound() public view returns (uint256) {
+        return currentRound;
+    }
+
+    // Bulk views, so reading a whole round takes one call per page instead of one "players(round, i)" call per entry
+    function getPlayerCount() public view returns (uint256) {
+        return entryCount[currentRound];
+    }
+
+    function getPlayers(
+        uint256 _round,
+        uint256 _offset,
+        uint256 _limit
+    )
+        public
+        view
+        returns (address[] memory players_, uint256[] memory cumulativeTickets_)
+    {
+        uint256 count = entryCount[_round];
+        if (_offset >= count) {
+            return (new address[](0), new uint256[](0));
+        }
+        uint256 end = _limit > count - _offset ? count : _offset + _limit;
+        players_ = new address[](end - _offset);
+        cumulativeTickets_ = new uint256[](end - _offset);
+        for (uint256 i = _offset; i < end; i++) {
+            Entry storage entry = entries[_round][i];
+            players_[i - _offset] = entry.player;
+            cumulativeTickets_[i - _offset] = entry.cumulativeTickets;
+        }
+    }
+
+    // everything the scripts used to read in separate round trips, in one call
+    function getRoundSummary()
+        public
+        view
+        returns (
+            uint256 round_,
+            LOTTERY_STATE state_,
+            uint256 playerCount_,
+            uint256 totalTickets_,
+            uint256 entranceFee_,
+            uint256 balance_,
+            address recentWinner_,
+            uint256 randomness_
+        )
+    {
+        round_ = currentRound;
+        return (
+            round_,
+            lottery_state,
+            entryCount[round_],
+            getTotalTickets(round_),
+            getEntranceFee(),
+            address(this).balance,
+            recentWinner,
+            randomness
+        );
     }
 
-    // below is the function for entrance fee amount
+    // below is the function for entrance fee amount, it returns exactly what "enter()" will charge right now
     function getEntranceFee() public view returns (uint256) {
-        (, int256 price, , , ) = ethUsdPriceFeed.latestRoundData(); // this code is taken from "solidity code" of "https://docs.chain.link/docs/get-the-latest-price/" by removing rest of the parameters from "funtion getThePrice()...{...}"
+        uint256 cached = cachedEntranceFee;
+        if (cached != 0 && block.timestamp < entranceFeeCheckedAt + feeCacheTtl) {
+            return cached;
+        }
+        (
+            uint80 roundId,
+            int256 price,
+            ,
+            uint256 updatedAt,
+
+        ) = ethUsdPriceFeed.latestRoundData(); // this code is taken from "solidity code" of "https://docs.chain.link/docs/get-the-latest-price/" by removing rest of the parameters from "funtion getThePrice()...{...}"
+        if (
+            cached != 0 &&
+            roundId == cachedFeedRoundId &&
+            updatedAt == cachedFeedUpdatedAt
+        ) {
+            return cached;
+        }
+        return _entranceFeeFromPrice(price);
+    }
+
+    // same as "getEntranceFee()" but also stores what it read, so the next entries can skip the price feed
+    function _refreshEntranceFee() internal returns (uint256) {
+        uint256 cached = cachedEntranceFee;
+        if (cached != 0 && block.timestamp < entranceFeeCheckedAt + feeCacheTtl) {
+            return cached;
+        }
+        (
+            uint80 roundId,
+            int256 price,
+            ,
+            uint256 updatedAt,
+
+        ) = ethUsdPriceFeed.latestRoundData();
+        if (
+            cached == 0 ||
+            roundId != cachedFeedRoundId ||
+            updatedAt != cachedFeedUpdatedAt
+        ) {
+            cached = _entranceFeeFromPrice(price);
+            cachedEntranceFee = uint96(cached);
+            cachedFeedRoundId = roundId;
+            cachedFeedUpdatedAt = uint40(updatedAt);
+        }
+        entranceFeeCheckedAt = uint40(block.timestamp);
+        return cached;
+    }
+
+    function _entranceFeeFromPrice(int256 price)
+        internal
+        view
+        returns (uint256)
+    {
         // now we have to convert the "int256 price" to "uint256 price" so...
         uint256 adjustedPrice = uint256(price) * 10**10; // converting into 18 decimal places
         // $50, $2,000 / ETH
@@ -81,11 +291,17 @@ contract Lottery is VRFConsumerBase, Ownable {
     // we could write our "onlyOwner" modifier or we can use OpenZeppelin's access control or OpenZepplin's ownable function but we're going to use "Ownable" instead...
     // using this link:-"https://docs.openzeppelin.com/contracts/4.x/api/access#ownable" copy the "import "@openzepplin/..." and paste it above
     function startLottery() public onlyOwner {
+        _startLottery();
+    }
+
+    // shared by "startLottery()" and "performUpkeep()"
+    function _startLottery() internal {
         require(
             lottery_state == LOTTERY_STATE.CLOSED,
             "Can't start a new lottery yet!"
         );
         lottery_state = LOTTERY_STATE.OPEN;
+        roundStartedAt = uint40(block.timestamp);
     }
 
     // Below is the 1st Transaction where we're going to request the data from the "Chainlink Oracle":-
@@ -101,6 +317,11 @@ contract Lottery is VRFConsumerBase, Ownable {
     // ...and then we talk why it's so vulnerable and not a good method of randomness and what some insecure protocols will do is they'll use a globally available variable and hash it so in our smart contracts there's actually a number of globally available variables,...
     // ...one of those as we saw above is "msg.value"  and "msg.sender" and we can see the whole list of globally available  variables list in solidity documentation at:- "https://docs.soliditylang.org/en/v0.8.7/units-and-global-variables.html", Let's see "block.difficulty (uint): current block difficulty".
     function endLottery() public onlyOwner {
+        _endLottery();
+    }
+
+    // shared by "endLottery()" and "performUpkeep()"
+    function _endLottery() internal {
         // Remember, as we said that `the time between different block generation is called the "block time"(view this at:-"https://2miners.com/eth-network-difficulty")` and we can keep that blocktime as ease by changing the block difficulty over time(i.e `The harder the problem/the proof of work algorithm the longer it's going to take or the more nodes we're going to need to solve that problem`)...
         // ...there's this constantly recalculating metric called "Ethereum Difficulty/Block Difficulty" depending on the chain that we're working on that constantly changes, so we might think this would be a great use of randomness right because it's a somewhat hard to predict number so what alot of people do is they think that,...
         // ... Hey! those sound pretty random let's use them as a unit of randomness and what we'll see is something like...in below code and we are converting everything here to "uint256(...)", the reason we're doing this of course is because we're going to want to pick a random winner based off of an index right from our "players array or list" (i.e. "address payable[] public players;") in above code
@@ -223,6 +444,47 @@ contract Lottery is VRFConsumerBase, Ownable {
     }
 
     // 2nd Callback Transaction:-
+    // Called off-chain (by the Keepers network or "scripts/lottery_keeper.py") every block, so it only reads storage.
+    // "performData" tells the caller what "performUpkeep()" will do, but "performUpkeep()" checks everything again itself.
+    function checkUpkeep(bytes calldata)
+        external
+        view
+        returns (bool upkeepNeeded, bytes memory performData)
+    {
+        UPKEEP_ACTION action = _upkeepAction();
+        return (action != UPKEEP_ACTION.NONE, abi.encode(action));
+    }
+
+    function performUpkeep(bytes calldata) external {
+        UPKEEP_ACTION action = _upkeepAction();
+        require(action != UPKEEP_ACTION.NONE, "No upkeep needed");
+        if (action == UPKEEP_ACTION.START) {
+            _startLottery();
+        } else {
+            _endLottery();
+        }
+    }
+
+    function _upkeepAction() internal view returns (UPKEEP_ACTION) {
+        if (roundDuration == 0) {
+            return UPKEEP_ACTION.NONE;
+        }
+        LOTTERY_STATE state = lottery_state;
+        if (state == LOTTERY_STATE.CLOSED) {
+            // the owner starts the very first round, after that we keep them coming
+            return currentRound > 0 ? UPKEEP_ACTION.START : UPKEEP_ACTION.NONE;
+        }
+        if (
+            state == LOTTERY_STATE.OPEN &&
+            block.timestamp >= roundStartedAt + roundDuration &&
+            entryCount[currentRound] >= minPlayers &&
+            LINK.balanceOf(address(this)) >= fee
+        ) {
+            return UPKEEP_ACTION.END;
+        }
+        return UPKEEP_ACTION.NONE;
+    }
+
     function fulfillRandomness(bytes32 _requestId, uint256 _randomness)
         internal
         override
@@ -255,20 +517,38 @@ contract Lottery is VRFConsumerBase, Ownable {
         // So here "doMOd" divides by the number and returns the remainder.
         } 
         */
-        uint256 indexOfWinner = _randomness % players.length;
-        // for example, Lets say we had 7 players signup and our random number was 22.
-        // here we want to get one of these random 7 players, So we would do,
+        uint256 round = currentRound;
+        uint256 winningTicket = _randomness % getTotalTickets(round);
+        // for example, Lets say we had 7 tickets sold and our random number was 22.
+        // here we want to get one of these random 7 tickets, So we would do,
         // 22 % 7 = 1
         // 7 * 3 = 21
         // 7 * 4 = 28, this is how we know that we reached our upper limit.
-        recentWinner = players[indexOfWinner];
-        // Now we got a winner(i.e recentWinner) and we want to pay(or transfer) them all the money gathered from our "function enter() public payablbe{...}" to the "address" below here
-        recentWinner.transfer(address(this).balance);
-        // "Reset" the lottery so that we can start from scratch/blank again
-        players = new address payable[](0);
+        // The winning purchase is the first one whose running ticket total is above the winning ticket,
+        // so we binary search the cumulative totals instead of keeping one array slot per ticket.
+        uint256 low = 0;
+        uint256 high = entryCount[round] - 1;
+        while (low < high) {
+            uint256 mid = (low + high) / 2;
+            if (entries[round][mid].cumulativeTickets > winningTicket) {
+                high = mid;
+            } else {
+                low = mid + 1;
+            }
+        }
+        address payable winner = entries[round][low].player;
+        // "Reset" the lottery so that we can start from scratch/blank again,
+        // the winner, the state and the round live in the same slot so these three writes only pay for one fresh SSTORE
+        recentWinner = winner;
         lottery_state = LOTTERY_STATE.CLOSED;
+        currentRound = uint48(round + 1);
         // I often also like to keep track of the most recent random number
         randomness = _randomness;
+        // Now we got a winner(i.e recentWinner) and we want to pay(or transfer) them all the money gathered from our "function enter() public payablbe{...}" to the "address" below here
+        uint256 prize = address(this).balance;
+        winner.transfer(prize);
+        emit WinnerPaid(round, winner, prize, _randomness);
+        emit RandomnessFulfilled(_requestId, winner, _randomness);
     }
 }
 
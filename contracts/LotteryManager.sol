@@ -0,0 +1,265 @@
+// SPDX-License-Identifier: MIT
+pragma solidity ^0.6.6;
+
+import "@chainlink/contracts/src/v0.6/interfaces/AggregatorV3Interface.sol";
+import "@openzeppelin/contracts/access/Ownable.sol";
+import "@chainlink/contracts/src/v0.6/VRFConsumerBase.sol";
+
+// One deployment (and one LINK balance) that runs many lotteries side by side, each with its own fee, state, pot and entrants.
+// It works just like "Lottery.sol" (one record per purchase, round-scoped entries, binary search for the winner),
+// but everything is keyed by a "lotteryId", and every VRF request remembers which lottery it belongs to,
+// so "fulfillRandomness()" can route the random number to the right lottery.
+contract LotteryManager is VRFConsumerBase, Ownable {
+    enum LOTTERY_STATE {
+        OPEN,
+        CLOSED,
+        CALCULATING_WINNER
+    }
+    struct Entry {
+        address payable player;
+        uint96 cumulativeTickets; // tickets sold up to and including this purchase
+    }
+    struct LotteryInfo {
+        uint256 usdEntryFee; // in terms of wei
+        uint256 round;
+        uint256 pot; // the ETH this lottery holds, the manager holds the ETH of every lottery
+        address payable recentWinner;
+        LOTTERY_STATE state;
+    }
+
+    AggregatorV3Interface public ethUsdPriceFeed;
+    uint256 public fee; // LINK paid per randomness request
+    bytes32 public keyhash;
+    uint256 public lotteryCount;
+    mapping(uint256 => LotteryInfo) public lotteries;
+    mapping(uint256 => mapping(uint256 => mapping(uint256 => Entry)))
+        public entries; // lottery => round => purchase index => entry
+    mapping(uint256 => mapping(uint256 => uint256)) public entryCount; // lottery => round => number of purchases
+    mapping(bytes32 => uint256) internal requestToLottery; // requestId => lotteryId + 1, so 0 means "unknown request"
+
+    event LotteryCreated(uint256 indexed lotteryId, uint256 usdEntryFee);
+    event LotteryEntered(
+        uint256 indexed lotteryId,
+        uint256 indexed round,
+        address indexed player,
+        uint256 tickets,
+        uint256 cumulativeTickets
+    );
+    event RequestedRandomness(uint256 indexed lotteryId, bytes32 requestId);
+    // same signature as in "Lottery.sol", so the scripts wait for both contracts the same way
+    event RandomnessFulfilled(
+        bytes32 indexed requestId,
+        address indexed winner,
+        uint256 randomness
+    );
+    event WinnerPaid(
+        uint256 indexed lotteryId,
+        uint256 indexed round,
+        address indexed winner,
+        uint256 amount,
+        uint256 randomness
+    );
+
+    constructor(
+        address _priceFeedAddress,
+        address _vrfCoordinator,
+        address _link,
+        uint256 _fee,
+        bytes32 _keyhash
+    ) public VRFConsumerBase(_vrfCoordinator, _link) {
+        ethUsdPriceFeed = AggregatorV3Interface(_priceFeedAddress);
+        fee = _fee;
+        keyhash = _keyhash;
+    }
+
+    modifier lotteryExists(uint256 _lotteryId) {
+        require(_lotteryId < lotteryCount, "No such lottery");
+        _;
+    }
+
+    function createLottery(uint256 _usdEntryFee)
+        public
+        onlyOwner
+        returns (uint256 lotteryId)
+    {
+        lotteryId = lotteryCount;
+        lotteryCount = lotteryId + 1;
+        LotteryInfo storage lottery = lotteries[lotteryId];
+        lottery.usdEntryFee = _usdEntryFee;
+        lottery.state = LOTTERY_STATE.CLOSED;
+        emit LotteryCreated(lotteryId, _usdEntryFee);
+    }
+
+    function createLotteries(uint256 _count, uint256 _usdEntryFee)
+        public
+        onlyOwner
+        returns (uint256 firstLotteryId)
+    {
+        firstLotteryId = lotteryCount;
+        for (uint256 i = 0; i < _count; i++) {
+            createLottery(_usdEntryFee);
+        }
+    }
+
+    function startLottery(uint256 _lotteryId)
+        public
+        onlyOwner
+        lotteryExists(_lotteryId)
+    {
+        require(
+            lotteries[_lotteryId].state == LOTTERY_STATE.CLOSED,
+            "Can't start a new lottery yet!"
+        );
+        lotteries[_lotteryId].state = LOTTERY_STATE.OPEN;
+    }
+
+    // starting (or ending) many lotteries in one transaction instead of one transaction per lottery
+    function startLotteries(uint256[] memory _lotteryIds) public onlyOwner {
+        for (uint256 i = 0; i < _lotteryIds.length; i++) {
+            startLottery(_lotteryIds[i]);
+        }
+    }
+
+    function enter(uint256 _lotteryId, uint256 _tickets)
+        public
+        payable
+        lotteryExists(_lotteryId)
+    {
+        LotteryInfo storage lottery = lotteries[_lotteryId];
+        require(lottery.state == LOTTERY_STATE.OPEN, "Lottery isn't open!");
+        require(_tickets > 0 && _tickets < 2**64, "Invalid ticket count");
+        uint256 round = lottery.round;
+        uint256 count = entryCount[_lotteryId][round];
+        uint256 cumulativeTickets = getTotalTickets(_lotteryId, round) +
+            _tickets;
+        require(cumulativeTickets <= uint96(-1), "Too many tickets!");
+        require(
+            msg.value >= getEntranceFee(_lotteryId) * _tickets,
+            "Not enough ETH!"
+        );
+        entries[_lotteryId][round][count] = Entry(
+            msg.sender,
+            uint96(cumulativeTickets)
+        );
+        entryCount[_lotteryId][round] = count + 1;
+        lottery.pot += msg.value;
+        emit LotteryEntered(
+            _lotteryId,
+            round,
+            msg.sender,
+            _tickets,
+            cumulativeTickets
+        );
+    }
+
+    function getEntranceFee(uint256 _lotteryId)
+        public
+        view
+        lotteryExists(_lotteryId)
+        returns (uint256)
+    {
+        (, int256 price, , , ) = ethUsdPriceFeed.latestRoundData();
+        uint256 adjustedPrice = uint256(price) * 10**10; // converting into 18 decimal places
+        return (lotteries[_lotteryId].usdEntryFee * 10**18) / adjustedPrice;
+    }
+
+    function getTotalTickets(uint256 _lotteryId, uint256 _round)
+        public
+        view
+        returns (uint256)
+    {
+        uint256 count = entryCount[_lotteryId][_round];
+        if (count == 0) {
+            return 0;
+        }
+        return entries[_lotteryId][_round][count - 1].cumulativeTickets;
+    }
+
+    function players(
+        uint256 _lotteryId,
+        uint256 _round,
+        uint256 _index
+    ) public view returns (address payable) {
+        require(_index < entryCount[_lotteryId][_round], "No such entry");
+        return entries[_lotteryId][_round][_index].player;
+    }
+
+    function endLottery(uint256 _lotteryId)
+        public
+        onlyOwner
+        lotteryExists(_lotteryId)
+    {
+        LotteryInfo storage lottery = lotteries[_lotteryId];
+        require(lottery.state == LOTTERY_STATE.OPEN, "Lottery isn't open!");
+        require(
+            entryCount[_lotteryId][lottery.round] > 0,
+            "Nobody entered this lottery!"
+        );
+        require(
+            LINK.balanceOf(address(this)) >= fee,
+            "Not enough LINK - fund the manager"
+        );
+        lottery.state = LOTTERY_STATE.CALCULATING_WINNER;
+        bytes32 requestId = requestRandomness(keyhash, fee);
+        requestToLottery[requestId] = _lotteryId + 1;
+        emit RequestedRandomness(_lotteryId, requestId);
+    }
+
+    function endLotteries(uint256[] memory _lotteryIds) public onlyOwner {
+        for (uint256 i = 0; i < _lotteryIds.length; i++) {
+            endLottery(_lotteryIds[i]);
+        }
+    }
+
+    function fulfillRandomness(bytes32 _requestId, uint256 _randomness)
+        internal
+        override
+    {
+        uint256 lotteryId = requestToLottery[_requestId];
+        require(lotteryId > 0, "Unknown request");
+        require(_randomness > 0, "random-not-found");
+        delete requestToLottery[_requestId];
+        lotteryId -= 1;
+        LotteryInfo storage lottery = lotteries[lotteryId];
+        require(
+            lottery.state == LOTTERY_STATE.CALCULATING_WINNER,
+            "You aren't there yet!"
+        );
+        uint256 round = lottery.round;
+        address payable winner = _findWinner(
+            lotteryId,
+            round,
+            _randomness % getTotalTickets(lotteryId, round)
+        );
+        uint256 prize = lottery.pot;
+        lottery.pot = 0;
+        lottery.recentWinner = winner;
+        lottery.round = round + 1;
+        lottery.state = LOTTERY_STATE.CLOSED;
+        winner.transfer(prize);
+        emit RandomnessFulfilled(_requestId, winner, _randomness);
+        emit WinnerPaid(lotteryId, round, winner, prize, _randomness);
+    }
+
+    // the winning purchase is the first one whose running ticket total is above the winning ticket
+    function _findWinner(
+        uint256 _lotteryId,
+        uint256 _round,
+        uint256 _winningTicket
+    ) internal view returns (address payable) {
+        mapping(uint256 => Entry) storage roundEntries = entries[_lotteryId][
+            _round
+        ];
+        uint256 low = 0;
+        uint256 high = entryCount[_lotteryId][_round] - 1;
+        while (low < high) {
+            uint256 mid = (low + high) / 2;
+            if (roundEntries[mid].cumulativeTickets > _winningTicket) {
+                high = mid;
+            } else {
+                low = mid + 1;
+            }
+        }
+        return roundEntries[low].player;
+    }
+}
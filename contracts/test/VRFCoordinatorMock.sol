@@ -5,10 +5,35 @@ pragma solidity 0.6.6;
 
 import "@chainlink/contracts/src/v0.6/interfaces/LinkTokenInterface.sol";
 import "@chainlink/contracts/src/v0.6/VRFConsumerBase.sol";
+import "@chainlink/contracts/src/v0.6/VRFRequestIDBase.sol";
 
-contract VRFCoordinatorMock {
+// On top of the chainlink-mix mock this one can answer requests by itself, so local rounds don't need
+// test code to call "callBackWithRandomness()" by hand:
+// - MANUAL: nothing happens until somebody calls "callBackWithRandomness()" (the original behaviour)
+// - SAME_BLOCK: the consumer is called back inside the request transaction itself
+// - NEXT_BLOCK: requests are queued and answered by the next "fulfillPending()" call
+// Auto answers use "uint256(keccak256(abi.encode(randomnessSeed, requestId)))", so a given seed replays the same rounds.
+// A same block callback that fails (e.g. the consumer only learns its requestId after "requestRandomness()" returns)
+// is queued for "fulfillPending()" instead of being lost.
+contract VRFCoordinatorMock is VRFRequestIDBase {
     LinkTokenInterface public LINK;
 
+    enum FulfillMode {
+        MANUAL,
+        SAME_BLOCK,
+        NEXT_BLOCK
+    }
+    struct PendingRequest {
+        bytes32 requestId;
+        address consumer;
+    }
+    FulfillMode public fulfillMode;
+    uint256 public randomnessSeed;
+    // kept in sync with the consumer's own nonces so we derive the same requestId as "VRFConsumerBase.requestRandomness()"
+    mapping(bytes32 => mapping(address => uint256)) public nonces;
+    PendingRequest[] public pendingRequests;
+    uint256 public nextPendingRequest;
+
     event RandomnessRequest(
         address indexed sender,
         bytes32 indexed keyHash,
@@ -19,6 +44,11 @@ contract VRFCoordinatorMock {
         LINK = LinkTokenInterface(linkAddress);
     }
 
+    function setFulfillMode(FulfillMode _mode, uint256 _randomnessSeed) public {
+        fulfillMode = _mode;
+        randomnessSeed = _randomnessSeed;
+    }
+
     function onTokenTransfer(
         address sender,
         uint256 fee,
@@ -26,6 +56,42 @@ contract VRFCoordinatorMock {
     ) public onlyLINK {
         (bytes32 keyHash, uint256 seed) = abi.decode(_data, (bytes32, uint256));
         emit RandomnessRequest(sender, keyHash, seed);
+        uint256 vRFSeed = makeVRFInputSeed(
+            keyHash,
+            seed,
+            sender,
+            nonces[keyHash][sender]
+        );
+        nonces[keyHash][sender] = nonces[keyHash][sender] + 1;
+        bytes32 requestId = makeRequestId(keyHash, vRFSeed);
+        if (fulfillMode == FulfillMode.SAME_BLOCK) {
+            if (!_callBack(requestId, randomnessFor(requestId), sender)) {
+                pendingRequests.push(PendingRequest(requestId, sender));
+            }
+        } else if (fulfillMode == FulfillMode.NEXT_BLOCK) {
+            pendingRequests.push(PendingRequest(requestId, sender));
+        }
+    }
+
+    function randomnessFor(bytes32 requestId) public view returns (uint256) {
+        return uint256(keccak256(abi.encode(randomnessSeed, requestId)));
+    }
+
+    function pendingRequestCount() public view returns (uint256) {
+        return pendingRequests.length - nextPendingRequest;
+    }
+
+    function fulfillPending() public {
+        uint256 end = pendingRequests.length;
+        for (uint256 i = nextPendingRequest; i < end; i++) {
+            PendingRequest memory request = pendingRequests[i];
+            _callBack(
+                request.requestId,
+                randomnessFor(request.requestId),
+                request.consumer
+            );
+        }
+        nextPendingRequest = end;
     }
 
     function callBackWithRandomness(
@@ -33,6 +99,14 @@ contract VRFCoordinatorMock {
         uint256 randomness,
         address consumerContract
     ) public {
+        _callBack(requestId, randomness, consumerContract);
+    }
+
+    function _callBack(
+        bytes32 requestId,
+        uint256 randomness,
+        address consumerContract
+    ) internal returns (bool) {
         VRFConsumerBase v;
         bytes memory resp = abi.encodeWithSelector(
             v.rawFulfillRandomness.selector,
@@ -42,6 +116,7 @@ contract VRFCoordinatorMock {
         uint256 b = 206000;
         require(gasleft() >= b, "not enough gas for consumer");
         (bool success, ) = consumerContract.call(resp);
+        return success;
     }
 
     modifier onlyLINK() {
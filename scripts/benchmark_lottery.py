@@ -0,0 +1,174 @@
+from scripts.helpful_scripts import (
+    LOCAL_BLOCKCHAIN_ENVIRONMENTS,
+    get_account,
+    get_contract,
+    fund_with_link,
+)
+from scripts.deploy_lottery import deploy_lottery
+from brownie import accounts, chain, network
+from pathlib import Path
+import json
+import sys
+import time
+
+# Measures how the gas and wall time of "enter()", "endLottery()" and the VRF callback ("callBackWithRandomness()" ->
+# "fulfillRandomness()") grow with the number of players, against the local mocks only.
+#   brownie run scripts/benchmark_lottery.py                   -> record a new baseline
+#   brownie run scripts/benchmark_lottery.py main compare      -> fail if we got slower than the baseline
+#   brownie run scripts/benchmark_lottery.py main record 10,100 -> only some scales
+#   brownie run scripts/benchmark_lottery.py main report       -> before/after gas of every function against the baseline
+# Views and getters are measured with "estimate_gas()", i.e. what reading them from a transaction costs. A getter from
+# "GETTERS" that the deployed "Lottery.sol" doesn't have yet (older versions lack e.g. "cachedEntranceFee" or
+# "getRoundSummary") is left out, and shows up as "new" in the report. For a before/after table of a contract change
+# record the baseline on the old contract with this script and run "report" on the new one:
+#   git worktree add ../lottery-before <old commit> && cp scripts/benchmark_lottery.py ../lottery-before/scripts/
+#   (cd ../lottery-before && brownie run scripts/benchmark_lottery.py main record 10)
+#   brownie run scripts/benchmark_lottery.py main report 10 ../lottery-before/benchmarks/lottery_baseline.json
+
+SCALES = (10, 100, 1000, 10000)
+BASELINE_PATH = "benchmarks/lottery_baseline.json"
+GAS_THRESHOLD = 0.05  # allowed gas regression, 5%
+TIME_THRESHOLD = 0.5  # allowed wall time regression, 50% since timings on a local chain are noisy
+STATIC_RNG = 777
+# read after the round is paid out, so every one of them returns real, non-zero state
+GETTERS = (
+    "lottery_state",
+    "recentWinner",
+    "lotteryRound",
+    "fee",
+    "keyhash",
+    "usdEntryFee",
+    "cachedEntranceFee",
+    "getRoundSummary",
+)
+
+
+def _timed(fn, *args):
+    started = time.perf_counter()
+    tx = fn(*args)
+    return tx, time.perf_counter() - started
+
+
+def _view_gas(method, *args):
+    started = time.perf_counter()
+    gas = method.estimate_gas(*args)
+    return {"gas": gas, "seconds": time.perf_counter() - started}
+
+
+def benchmark_round(players):
+    account = get_account()
+    lottery = deploy_lottery()
+    results = {}
+
+    tx, seconds = _timed(lottery.startLottery, {"from": account})
+    results["startLottery"] = {"gas": tx.gas_used, "seconds": seconds}
+
+    # a view, so we record what calling it from a transaction would cost
+    results["getEntranceFee"] = _view_gas(lottery.getEntranceFee)
+    fee = lottery.getEntranceFee()
+    gas, latencies = [], []
+    for i in range(players):
+        tx, seconds = _timed(
+            lottery.enter, {"from": accounts[i % len(accounts)], "value": fee}
+        )
+        gas.append(tx.gas_used)
+        latencies.append(seconds)
+    results["enter"] = {
+        "gas": sum(gas) / players,
+        "gas_max": max(gas),
+        "seconds": sum(latencies) / players,
+        "seconds_total": sum(latencies),
+    }
+
+    tx, seconds = _timed(
+        lottery.enterTickets, 5, {"from": account, "value": fee * 5}
+    )
+    results["enterTickets"] = {"gas": tx.gas_used, "seconds": seconds}
+
+    fund_with_link(lottery)
+    tx, seconds = _timed(lottery.endLottery, {"from": account})
+    results["endLottery"] = {"gas": tx.gas_used, "seconds": seconds}
+
+    request_id = tx.events["RequestedRandomness"]["requestId"]
+    tx, seconds = _timed(
+        get_contract("vrf_coordinator").callBackWithRandomness,
+        request_id,
+        STATIC_RNG,
+        lottery.address,
+        {"from": account},
+    )
+    results["callBackWithRandomness"] = {"gas": tx.gas_used, "seconds": seconds}
+
+    for getter in GETTERS:
+        if hasattr(lottery, getter):
+            results[getter] = _view_gas(getattr(lottery, getter))
+    return results
+
+
+def run_benchmarks(scales=SCALES):
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        raise ValueError("Benchmarks only run against the local mocks")
+    get_contract("vrf_coordinator")  # deploy the mocks before the first snapshot
+    report = {}
+    for players in scales:
+        # every scale starts from the same chain state
+        chain.snapshot()
+        report[str(players)] = benchmark_round(players)
+        chain.revert()
+        print(f"{players} players: {json.dumps(report[str(players)])}")
+    return report
+
+
+def compare(report, baseline, gas_threshold=GAS_THRESHOLD, time_threshold=TIME_THRESHOLD):
+    """Returns a list of regressions, one line per (scale, operation, metric)
+    that got worse than the baseline by more than the threshold."""
+    regressions = []
+    for scale, operations in report.items():
+        for operation, metrics in operations.items():
+            base = baseline.get(scale, {}).get(operation)
+            if base is None:
+                continue
+            for metric, threshold in (("gas", gas_threshold), ("seconds", time_threshold)):
+                if metrics[metric] > base[metric] * (1 + threshold):
+                    regressions.append(
+                        f"{scale} players {operation} {metric}: "
+                        f"{base[metric]:.6g} -> {metrics[metric]:.6g}"
+                    )
+    return regressions
+
+
+def gas_report(report, baseline):
+    """Returns one line per (scale, operation) with the baseline gas, the new
+    gas and the change, e.g. to show what a contract change saved."""
+    lines = []
+    for scale, operations in report.items():
+        for operation, metrics in operations.items():
+            base = baseline.get(scale, {}).get(operation)
+            if base is None:
+                lines.append(f"{scale} players {operation}: new -> {metrics['gas']:.6g}")
+                continue
+            change = (metrics["gas"] - base["gas"]) / base["gas"] * 100
+            lines.append(
+                f"{scale} players {operation}: {base['gas']:.6g} -> {metrics['gas']:.6g} ({change:+.1f}%)"
+            )
+    return lines
+
+
+def main(mode="record", scales=None, baseline_path=BASELINE_PATH):
+    scales = tuple(int(s) for s in scales.split(",")) if scales else SCALES
+    report = run_benchmarks(scales)
+    path = Path(baseline_path)
+    if mode == "report":
+        for line in gas_report(report, json.loads(path.read_text())):
+            print(line)
+    elif mode == "compare":
+        regressions = compare(report, json.loads(path.read_text()))
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline")
+    else:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(report, indent=2, sort_keys=True))
+        print(f"Baseline written to {path}")
@@ -0,0 +1,143 @@
+from scripts.entrance_fee import get_entrance_fee
+from scripts.tx_engine import NonceTracker, get_receipt
+from brownie import Lottery, accounts, exceptions
+from collections import deque, namedtuple
+import math
+import time
+
+# "enter_lottery()" sends one entry and waits a block for it, here we keep many "enter()" transactions in flight at once
+# and only look at the receipts afterwards, so a whole batch can land in the same few blocks.
+
+FEE_BUFFER = 100000000  # same extra "wei" that "enter_lottery()" adds just to be safe
+GAS_LIMIT_MARGIN = 1.2  # we estimate "enter()" gas once and reuse it (plus this margin) for the whole batch
+LATENCY_PERCENTILES = (50, 90, 99)
+
+BulkEntryReport = namedtuple(
+    "BulkEntryReport",
+    [
+        "succeeded",
+        "failed",
+        "elapsed",
+        "entries_per_second",
+        "latency_percentiles",
+    ],
+)
+
+
+def percentile(sorted_values, pct):
+    # nearest-rank percentile (the smallest value with at least "pct"% of the values at or below it), "sorted_values"
+    # must already be sorted
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(pct * len(sorted_values) / 100) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def bulk_enter_lottery(
+    lottery=None,
+    entrants=None,
+    entries_per_account=1,
+    max_in_flight=50,
+    max_retries=2,
+    poll_interval=0.1,
+    timeout=300,
+):
+    """Enters the lottery `entries_per_account` times from every account in
+    `entrants`, keeping up to `max_in_flight` transactions pending at once.
+        Args:
+            lottery (brownie.network.contract.ProjectContract): defaults to
+            Lottery[-1]
+            entrants (list): brownie accounts, defaults to all local accounts
+            max_retries (int): how many times a failed entry is sent again,
+            failed entries are re-queued so they never block the rest
+            timeout (int): seconds before giving up on unconfirmed entries
+        Returns:
+            BulkEntryReport
+    """
+    lottery = lottery if lottery else Lottery[-1]
+    entrants = entrants if entrants else list(accounts)
+    # one fee quote and one gas estimate for the whole batch
+    value = get_entrance_fee(lottery) + FEE_BUFFER
+    gas_limit = int(
+        lottery.enter.estimate_gas({"from": entrants[0], "value": value})
+        * GAS_LIMIT_MARGIN
+    )
+    nonces = NonceTracker()
+    # round-robin over the accounts so every account has a few entries in flight at once
+    queue = deque(
+        (account, 0) for _ in range(entries_per_account) for account in entrants
+    )
+    in_flight = {}  # txid -> (account, attempts, submitted_at)
+    latencies = []
+    failed = 0
+    started = time.time()
+    deadline = started + timeout
+    while queue or in_flight:
+        while queue and len(in_flight) < max_in_flight:
+            account, attempts = queue.popleft()
+            submitted_at = time.time()
+            try:
+                tx = lottery.enter(
+                    {
+                        "from": account,
+                        "value": value,
+                        "nonce": nonces.next(account),
+                        "gas_limit": gas_limit,
+                        "allow_revert": True,
+                        "required_confs": 0,
+                    }
+                )
+            except (ValueError, exceptions.VirtualMachineError) as error:
+                # the node rejected it so the nonce was never used, start again from the node's view
+                nonces.resync(account)
+                if attempts < max_retries:
+                    queue.append((account, attempts + 1))
+                else:
+                    print(f"Entry from {account} failed: {error}")
+                    failed += 1
+                continue
+            in_flight[tx.txid] = (account, attempts, submitted_at)
+
+        for txid in list(in_flight):
+            receipt = get_receipt(txid)
+            if receipt is None:
+                continue
+            account, attempts, submitted_at = in_flight.pop(txid)
+            if receipt.status == 1:
+                latencies.append(time.time() - submitted_at)
+            elif attempts < max_retries:
+                queue.append((account, attempts + 1))
+            else:
+                print(f"Entry {txid} from {account} reverted")
+                failed += 1
+
+        if time.time() > deadline:
+            print(f"Timed out with {len(in_flight) + len(queue)} entries unconfirmed")
+            failed += len(in_flight) + len(queue)
+            break
+        if in_flight and (not queue or len(in_flight) >= max_in_flight):
+            time.sleep(poll_interval)
+
+    elapsed = time.time() - started
+    latencies.sort()
+    report = BulkEntryReport(
+        succeeded=len(latencies),
+        failed=failed,
+        elapsed=elapsed,
+        entries_per_second=len(latencies) / elapsed if elapsed > 0 else 0,
+        latency_percentiles={
+            pct: percentile(latencies, pct) for pct in LATENCY_PERCENTILES
+        },
+    )
+    print(
+        f"Entered {report.succeeded} times ({report.failed} failed) in {elapsed:.2f}s, "
+        f"{report.entries_per_second:.1f} entries/sec"
+    )
+    for pct, latency in report.latency_percentiles.items():
+        if latency is not None:
+            print(f"  p{pct} latency: {latency * 1000:.0f}ms")
+    return report
+
+
+def main():
+    bulk_enter_lottery()
@@ -1,7 +1,22 @@
-from scripts.helpful_scripts import get_account, get_contract, fund_with_link
-from brownie import Lottery, network, config
+from scripts.helpful_scripts import (
+    get_account,
+    get_contract,
+    ensure_link_funded,
+    link_funding_savings,
+    wait_for_fulfillment,
+    wait_for_fulfillments,
+    fulfill_pending_requests,
+    set_vrf_fulfill_mode,
+    LOCAL_BLOCKCHAIN_ENVIRONMENTS,
+    VRF_FULFILL_MODES,
+)
+from scripts.entrance_fee import get_entrance_fee
+from scripts.tx_engine import TransactionFailed, TxEngine
+from brownie import Lottery, LotteryManager, network, config
+from hexbytes import HexBytes
 
-import time
+
+END_LOTTERY_GAS_LIMIT = 500000  # "endLottery()" plus the LINK "transferAndCall()" to the VRF Coordinator, with headroom
 
 
 def deploy_lottery():
@@ -22,6 +37,15 @@ def deploy_lottery():
         get_contract("link_token").address,  # address _link
         config["networks"][network.show_active()]["fee"],  # uint256 _fee
         config["networks"][network.show_active()]["keyhash"],  # bytes32 _keyhash
+        config["networks"][network.show_active()].get(
+            "fee_cache_ttl", 0
+        ),  # uint256 _feeCacheTtl
+        config["networks"][network.show_active()].get(
+            "round_duration", 0
+        ),  # uint256 _roundDuration
+        config["networks"][network.show_active()].get(
+            "min_players", 1
+        ),  # uint256 _minPlayers
         {"from": account},
         publish_source=config["networks"][network.show_active()].get("verify", False),
         # here `.get(verify", False)` says "get" that "verify key" but if there is no "verify key" there, just default to "false"
@@ -30,30 +54,53 @@ def deploy_lottery():
     return lottery
 
 
-def start_lottery():
+def start_lottery(engine=None, after=()):
     account = get_account()
     lottery = Lottery[-1]
+    # With an "engine" (scripts/tx_engine.py) we only submit and hand back the Future, so the next step can chain on it
+    if engine:
+        return engine.submit(
+            lottery.startLottery, tx_params={"from": account}, after=after
+        )
     # Now we are changing Lottery stage
     starting_tx = lottery.startLottery({"from": account})
     # here we wait for the last transaction to complete otherwise brownie would gets confused at the end
     starting_tx.wait(1)
     print("The lottery is started!")
+    return starting_tx
 
 
-def enter_lottery():
+def enter_lottery(engine=None, after=()):
     account = get_account()
     lottery = Lottery[-1]
     value = (
-        lottery.getEntranceFee() + 100000000
+        get_entrance_fee(lottery) + 100000000
     )  # here we take some extra "wei" just to be safe
+    if engine:
+        return engine.submit(
+            lottery.enter, tx_params={"from": account, "value": value}, after=after
+        )
     tx = lottery.enter({"from": account, "value": value})
     tx.wait(1)
     print("You entered the lottery!")
+    return tx
+
+
+def buy_tickets(tickets, account=None):
+    # One "enterTickets()" transaction buys all the tickets, so it costs about the same gas as a single entry
+    account = account if account else get_account()
+    lottery = Lottery[-1]
+    value = get_entrance_fee(lottery) * tickets + 100000000  # same extra "wei" as above just to be safe
+    tx = lottery.enterTickets(tickets, {"from": account, "value": value})
+    tx.wait(1)
+    print(f"You bought {tickets} tickets!")
+    return tx
 
 
-def end_lottery():
+def end_lottery(engine=None, after=()):
     account = get_account()
     lottery = Lottery[-1]
+    engine = engine if engine else TxEngine()
     # Now before we actually end this lottery we're going to need some "LINK Token" in this particular Contract...
     # ...because if we remember our "endLottery()" calls "requestRandomness(keyhash, fee)" and we can only request...
     # ...some randomness if our contract has somme Chainlink Token associated with it that's why...
@@ -61,25 +108,226 @@ def end_lottery():
     # ...and then end the lottery
     # Since funding our contracts with the LINK Token is going to be a pretty common function that we use,...
     # ...so lets move this new function code into the "helpful_scripts.py"
-    tx = fund_with_link(lottery.address)
-    tx.wait(1)
-    # Once we're funded with link then we can go ahead to call "endLottery()" in below code
-    ending_transaction = lottery.endLottery({"from": account})
-    ending_transaction.wait(1)
+    # The funding manager only sends LINK when the contract can't pay for this request, topped up for several rounds
+    funded = ensure_link_funded(lottery.address, engine=engine, after=after)
+    # Once we're funded with link then we can go ahead to call "endLottery()" in below code.
+    # Both come from the same account, so the node always runs "endLottery()" after the LINK transfer (nonce order)
+    # and we don't have to wait a block for the funding to confirm. We only have to skip brownie's gas estimate,
+    # which would fail before the LINK has arrived, by giving a gas limit ourselves.
+    ended = engine.submit(
+        lottery.endLottery,
+        tx_params={
+            "from": account,
+            "gas_limit": END_LOTTERY_GAS_LIMIT,
+            "allow_revert": True,
+        },
+        after=after,
+    )
+    engine.wait([future for future in (funded, ended) if future is not None])
+    ending_transaction = ended.result()
+    # locally our mock coordinator may have queued the request instead of answering it right away ("next_block" mode)
+    fulfill_pending_requests()
     # Remember:- When we call this "endlottery()"[i.e in Lottery.sol] we're going to make a request to a `Chainlink Node` and this `Chainlink Node` is going to respond by calling this "fulfillRandomness()"[i.e in Lottery.sol]...
     # ...so we actually have to wait for that Chainlink Node to finish.
-    # Now, typically it's within few blocks so normally what we can do is we can just do a "time.sleep(60)"(i.e for 60 sec) and during this time the `Chainlink Node` will have responded so we do "import time"
-    time.sleep(60)
-    print(f"{lottery.recentWinner()} is the new winner!")
+    # Instead of a fixed "time.sleep(60)" we wait for the "RandomnessFulfilled" event that matches our "requestId", so we return as soon as the node has responded
+    try:
+        fulfillment = wait_for_fulfillment(lottery, ending_transaction)
+    except TimeoutError as error:
+        # on a local chain there is no `Chainlink Node`, so in "manual" mode nobody answers unless we call "callBackWithRandomness()" ourselves
+        print(error)
+        return None
+    print(f"{fulfillment.winner} is the new winner!")
+    return fulfillment
+
+
+# Below is the id-addressed API for "LotteryManager.sol", one deployment running many lotteries at once.
+# Starting and ending is batched on-chain ("startLotteries()"/"endLotteries()"), and the batches are all sent
+# before we wait for any of them, so hundreds of lotteries take a handful of blocks instead of one block each.
+
+USD_ENTRY_FEE = 50 * (10**18)
+MANAGER_BATCH_SIZE = 50  # lotteries per transaction, "endLottery()" alone costs a LINK "transferAndCall()" each
+
+
+class BatchesFailed(TransactionFailed):
+    """Raised when some of the batches sent by "_send_batches()" failed. The
+    receipts of the batches that went through are in "transactions", and
+    "end_lotteries()" adds the Fulfillments it still got for them as "results".
+    """
+
+    def __init__(self, error, transactions, results=None):
+        super().__init__(f"{error} ({len(transactions)} batch(es) went through)")
+        self.error = error
+        self.transactions = transactions
+        self.results = results
+
+
+def deploy_lottery_manager():
+    account = get_account()
+    manager = LotteryManager.deploy(
+        get_contract("eth_usd_price_feed").address,
+        get_contract("vrf_coordinator").address,
+        get_contract("link_token").address,
+        config["networks"][network.show_active()]["fee"],
+        config["networks"][network.show_active()]["keyhash"],
+        {"from": account},
+        publish_source=config["networks"][network.show_active()].get("verify", False),
+    )
+    print("Deployed lottery manager!")
+    return manager
+
+
+def _send_batches(method, batches, account):
+    # every batch goes out with its own nonce without waiting, then we wait for all of them together
+    engine = TxEngine()
+    futures = [
+        engine.submit(method, *batch, tx_params={"from": account})
+        for batch in batches
+    ]
+    try:
+        return engine.wait(futures)
+    except Exception as error:
+        # "wait()" raises the first failure once every batch has resolved, the batches that did go through are
+        # on chain all the same and the caller still needs their receipts (e.g. for the requestIds they emitted)
+        transactions = [
+            future.result()
+            for future in futures
+            if future.done() and future.exception() is None
+        ]
+        raise BatchesFailed(error, transactions) from error
+
+
+def _chunks(lottery_ids):
+    lottery_ids = list(lottery_ids)
+    return [
+        lottery_ids[i : i + MANAGER_BATCH_SIZE]
+        for i in range(0, len(lottery_ids), MANAGER_BATCH_SIZE)
+    ]
+
+
+def create_lotteries(count, usd_entry_fee=USD_ENTRY_FEE, manager=None):
+    account = get_account()
+    manager = manager if manager else LotteryManager[-1]
+    if count <= 0:
+        # "createLotteries(0)" would emit no "LotteryCreated" event at all
+        return []
+    tx = manager.createLotteries(count, usd_entry_fee, {"from": account})
+    tx.wait(1)
+    lottery_ids = [event["lotteryId"] for event in tx.events["LotteryCreated"]]
+    print(f"Created lotteries {lottery_ids[0]}..{lottery_ids[-1]}!")
+    return lottery_ids
+
+
+def start_lotteries(lottery_ids, manager=None):
+    account = get_account()
+    manager = manager if manager else LotteryManager[-1]
+    txs = _send_batches(
+        manager.startLotteries, [(batch,) for batch in _chunks(lottery_ids)], account
+    )
+    print(f"Started {len(lottery_ids)} lotteries!")
+    return txs
+
+
+def enter_lottery_by_id(lottery_id, tickets=1, account=None, manager=None):
+    account = account if account else get_account()
+    manager = manager if manager else LotteryManager[-1]
+    value = manager.getEntranceFee(lottery_id) * tickets + 100000000
+    tx = manager.enter(lottery_id, tickets, {"from": account, "value": value})
+    tx.wait(1)
+    print(f"You entered lottery {lottery_id}!")
+    return tx
+
+
+def end_lotteries(lottery_ids, manager=None, timeout=None):
+    """Ends every lottery in `lottery_ids` and waits for all of their VRF
+    callbacks together.
+        Returns:
+            dict: lottery id -> Fulfillment (missing if the callback timed out)
+        Raises:
+            BatchesFailed: if a batch reverted, after waiting for the rounds
+            of the batches that went through (see its "results")
+    """
+    if not lottery_ids:
+        return {}
+    account = get_account()
+    manager = manager if manager else LotteryManager[-1]
+    # at most one LINK transfer pays for every randomness request in the batch. "fee" already covers the whole batch,
+    # so it's topped up for this one batch instead of "link_rounds_to_fund" more of them
+    ensure_link_funded(
+        manager.address,
+        fee=config["networks"][network.show_active()]["fee"] * len(lottery_ids),
+        rounds=1,
+    )
+    failure = None
+    try:
+        txs = _send_batches(
+            manager.endLotteries, [(batch,) for batch in _chunks(lottery_ids)], account
+        )
+    except BatchesFailed as error:
+        # the rounds in the batches that went through are calculating their winners now, so we still wait for those
+        # before raising, otherwise their request ids would be lost with the exception
+        print(error)
+        failure = error
+        txs = error.transactions
+    results = _wait_for_round_ends(manager, txs, timeout)
+    if failure is not None:
+        failure.results = results
+        raise failure
+    print(f"Ended {len(results)} lotteries!")
+    return results
+
+
+def _wait_for_round_ends(manager, txs, timeout):
+    if not txs:
+        return {}
+    # the manager only learns a requestId once "requestRandomness()" returns, so a "same_block" mock can't call it
+    # back inside "endLotteries()" and queues those requests for us to answer here instead
+    fulfill_pending_requests()
+    requests = {
+        event["requestId"]: event["lotteryId"]
+        for tx in txs
+        for event in tx.events["RequestedRandomness"]
+    }
+    try:
+        fulfillments = wait_for_fulfillments(
+            manager,
+            list(requests),
+            min(tx.block_number for tx in txs),
+            timeout=timeout,
+        )
+    except TimeoutError as error:
+        print(error)
+        return {}
+    return {
+        requests[request_id]: fulfillments[HexBytes(request_id).hex()]
+        for request_id in requests
+    }
+
+
+def start_lottery_by_id(lottery_id, manager=None):
+    return start_lotteries([lottery_id], manager)[0]
+
+
+def end_lottery_by_id(lottery_id, manager=None, timeout=None):
+    return end_lotteries([lottery_id], manager, timeout).get(lottery_id)
 
 
 def main():
     deploy_lottery()
-    start_lottery()
-    enter_lottery()
-    end_lottery()
+    if network.show_active() in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        # there is no `Chainlink Node` locally, so unless "vrf_fulfill_mode" already has our mock coordinator answering by
+        # itself we switch it to answering the request inside "endLottery()"
+        vrf_coordinator = get_contract("vrf_coordinator")
+        if vrf_coordinator.fulfillMode() == VRF_FULFILL_MODES["manual"]:
+            set_vrf_fulfill_mode("same_block", vrf_coordinator=vrf_coordinator)
+    # every step is chained on the confirmation of the one it needs, instead of a "tx.wait(1)" after each of them
+    engine = TxEngine()
+    started = start_lottery(engine)
+    entered = enter_lottery(engine, after=[started])
+    end_lottery(engine, after=[entered])
+    print(f"LINK funding: {link_funding_savings()}")
 
 
+# (These days "main()" switches a "manual" "VRFCoordinatorMock" to its "same_block" mode on local networks, so the round below runs end to end and prints a real winner.)
 # Now after running "brownie run scripts/deploy_lottery.py" we get lots of transaction done and after waiting for few seconds our Contract will give "0x0000000000000000000000000000000000000000 is the new winner!"
 # this is because there is no `Chainlink Node` that's going to call this "fulfillRandomness()" right now, so for our "Ganache chain" this will hypothetically end with `nothing or zeros` as "winner" as our output...
 # ...because there is no `Chainlink Node` actually responding on our local 'Ganache' here.
@@ -0,0 +1,95 @@
+from brownie import network, config, web3
+from pathlib import Path
+import json
+import os
+
+# "get_contract()" used to re-resolve (or even redeploy) every mock and build a fresh "Contract.from_abi()" object on each call.
+# Here we remember the addresses on disk, keyed by network name and chain id, so repeated runs against a persistent chain
+# (e.g. "ganache-local") reuse the same deployments, and we keep the "Contract" objects in memory for the rest of the run.
+# Before trusting an address from disk we compare the hash of its code, which is one cheap "eth_getCode" per contract
+# per run and tells us if the chain was reset or something else now lives at that address.
+
+REGISTRY_PATH = "build/deployment_registry.json"
+
+_contracts = {}  # (network key, contract name) -> Contract
+_chain_ids = {}  # network name -> chain id
+
+
+def network_key():
+    active = network.show_active()
+    if active not in _chain_ids:
+        _chain_ids[active] = web3.eth.chain_id
+    return f"{active}:{_chain_ids[active]}"
+
+
+def _registry_path():
+    return Path(config.get("deployment_registry", REGISTRY_PATH))
+
+
+def _read_registry():
+    path = _registry_path()
+    if not path.exists():
+        return {}
+    try:
+        return json.loads(path.read_text())
+    except ValueError:
+        # a half written or hand edited file is just a cache miss
+        return {}
+
+
+def _write_registry(registry):
+    path = _registry_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # write to a temporary file first so parallel test workers never read half a file
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(registry, indent=2, sort_keys=True))
+    os.replace(tmp_path, path)
+
+
+def _code_hash(address):
+    return web3.keccak(web3.eth.get_code(address)).hex()
+
+
+def cached_contract(contract_name):
+    # in-process only, no RPC at all
+    return _contracts.get((network_key(), contract_name))
+
+
+def load_contract(contract_name, contract_type):
+    """Returns the registered contract for `contract_name` on the active
+    network, or None if there is none or its code no longer matches.
+        Args:
+            contract_name (string): the "contract_to_mock" key, e.g. "link_token"
+            contract_type (brownie.network.contract.ContractContainer)
+        Returns:
+            brownie.network.contract.ProjectContract or None
+    """
+    contract = cached_contract(contract_name)
+    if contract is not None:
+        return contract
+    record = _read_registry().get(network_key(), {}).get(contract_name)
+    if record is None or _code_hash(record["address"]) != record["code_hash"]:
+        return None
+    # ".at()" also adds it to the container, so "MockV3Aggregator[-1]" keeps working
+    contract = contract_type.at(record["address"])
+    _contracts[(network_key(), contract_name)] = contract
+    return contract
+
+
+def register_contract(contract_name, contract, persist=True):
+    # live addresses come from the network config on every run, so for those `persist=False` skips the disk write and
+    # its "eth_getCode" and we only keep the in-process cache
+    key = network_key()
+    _contracts[(key, contract_name)] = contract
+    if not persist:
+        return
+    registry = _read_registry()
+    record = {"address": contract.address, "code_hash": _code_hash(contract.address)}
+    if registry.get(key, {}).get(contract_name) != record:
+        registry.setdefault(key, {})[contract_name] = record
+        _write_registry(registry)
+
+
+def clear_cache():
+    # for when the chain was reset or reverted underneath us, the on-disk registry is re-validated on the next lookup
+    _contracts.clear()
@@ -0,0 +1,97 @@
+from scripts.deployment_registry import network_key
+from brownie import Contract, MockV3Aggregator, chain, network, config
+import time
+
+# Client side twin of the entrance fee cache in "Lottery.sol": instead of calling "getEntranceFee()" before every entry
+# we keep the last quote for "entrance_fee_ttl" seconds, and after that we only ask the lottery again if the price feed
+# has moved on to a new round.
+# The lottery itself keeps charging its cached fee for up to "feeCacheTtl" seconds after the feed moves on, so a quote
+# that came from a lagging contract cache is only good until "entranceFeeCheckedAt + feeCacheTtl" (block time), after
+# which the contract switches to the new fee and so do we.
+
+ENTRANCE_FEE_TTL = 15
+
+
+class EntranceFeeCache:
+    def __init__(self, lottery, ttl=None):
+        self.lottery = lottery
+        self.ttl = (
+            ttl
+            if ttl is not None
+            else config["networks"][network.show_active()].get(
+                "entrance_fee_ttl", ENTRANCE_FEE_TTL
+            )
+        )
+        self._price_feed = None
+        self._fee = None
+        self._feed_round = None
+        self._checked_at = 0
+        self._valid_until = None  # block time the contract stops charging "_fee", None while the feed doesn't move
+        self._fee_cache_ttl = None
+
+    @property
+    def price_feed(self):
+        if self._price_feed is None:
+            # "MockV3Aggregator.abi" is a full "AggregatorV3Interface" ABI, same trick as "get_contract()" uses for live feeds
+            self._price_feed = Contract.from_abi(
+                MockV3Aggregator._name,
+                self.lottery.ethUsdPriceFeed(),
+                MockV3Aggregator.abi,
+            )
+        return self._price_feed
+
+    def _contract_expiry(self, feed_round):
+        # If the contract's own cache is still on an older feed round it keeps charging that old fee until its TTL runs
+        # out, so that's as long as our quote is good for
+        contract_round = (
+            self.lottery.cachedFeedRoundId(),
+            self.lottery.cachedFeedUpdatedAt(),
+        )
+        if contract_round == feed_round:
+            return None
+        if self._fee_cache_ttl is None:
+            self._fee_cache_ttl = self.lottery.feeCacheTtl()
+        valid_until = self.lottery.entranceFeeCheckedAt() + self._fee_cache_ttl
+        # past its TTL "getEntranceFee()" already prices from the feed, just like the next "enter()" will
+        return valid_until if chain.time() < valid_until else None
+
+    def _expired(self):
+        return self._valid_until is not None and chain.time() >= self._valid_until
+
+    def get(self):
+        now = time.time()
+        if (
+            self._fee is not None
+            and now < self._checked_at + self.ttl
+            and not self._expired()
+        ):
+            return self._fee
+        round_id, _, _, updated_at, _ = self.price_feed.latestRoundData()
+        feed_round = (round_id, updated_at)
+        if self._fee is None or feed_round != self._feed_round or self._expired():
+            self._fee = self.lottery.getEntranceFee()
+            self._feed_round = feed_round
+            self._valid_until = self._contract_expiry(feed_round)
+        self._checked_at = now
+        return self._fee
+
+    def invalidate(self):
+        self._fee = None
+
+
+_caches = {}  # (network key, lottery address) -> EntranceFeeCache
+
+
+def get_entrance_fee(lottery):
+    """Returns the lottery's entrance fee, cached per network and lottery
+    address."""
+    key = (network_key(), lottery.address)
+    cache = _caches.get(key)
+    if cache is None:
+        cache = _caches[key] = EntranceFeeCache(lottery)
+    return cache.get()
+
+
+def clear_cache():
+    # for when the chain was reset or reverted underneath us, a quote from before could undercharge the next "enter()"
+    _caches.clear()
@@ -0,0 +1,348 @@
+from scripts.lottery_indexer import INDEXER_DB
+from brownie import Lottery, config
+from bisect import bisect_right
+from collections import namedtuple
+from pathlib import Path
+import math
+import random
+import sqlite3
+
+try:
+    import numpy as np
+except ImportError:  # the auditor still works without numpy, just a lot slower
+    np = None
+
+# Replays the winner selection of "fulfillRandomness()" offline, for every round the indexer has seen (or for synthetic
+# rounds), and checks it against the recorded winners without a single contract call:
+#   winning ticket = randomness % total tickets
+#   winner         = the first purchase whose running ticket total is above the winning ticket
+# It also adds up, per address, how many wins its tickets should have brought (its tickets / total tickets, summed over
+# every round) against how many it got, and bounds the modulo bias of "randomness % total tickets".
+#   brownie run scripts/lottery_indexer.py && brownie run scripts/fairness_audit.py
+#   brownie run scripts/fairness_audit.py main synthetic 1000000
+# Rounds are streamed in batches of "batch_rounds" flat columns (running totals, player ids, randomness bytes), so memory
+# use doesn't grow with the number of rounds, and with numpy a whole batch is checked with a handful of array operations:
+# the 256 bit randomness is read as eight 32 bit limbs and reduced modulo the total with Horner's rule in uint64 (which
+# can't overflow while the total is below 2**32), and every winner comes out of one "searchsorted()" over the batch.
+
+BATCH_ROUNDS = 65536
+MAX_REPORTED_MISMATCHES = 100
+LIMB_BITS = 32
+LIMBS = 256 // LIMB_BITS
+NO_WINNER = -1  # "recorded" value of a round without a recorded winner to check
+
+# One batch of rounds as flat columns. "cumulative" and "players" have one value per purchase, rounds after each other,
+# "counts" says how many purchases each round has, "randomness" is 32 big endian bytes per round and "players"/"recorded"
+# are ids from an "AddressBook".
+RoundBatch = namedtuple(
+    "RoundBatch",
+    ["rounds", "counts", "cumulative", "players", "randomness", "recorded"],
+)
+AddressStats = namedtuple(
+    "AddressStats", ["address", "rounds", "tickets", "wins", "expected_wins", "z_score"]
+)
+AuditReport = namedtuple(
+    "AuditReport",
+    [
+        "rounds",
+        "checked",  # rounds that had a recorded winner to compare against
+        "mismatch_count",
+        "mismatches",  # the first MAX_REPORTED_MISMATCHES (round, expected, recorded)
+        "max_total_tickets",
+        "modulo_bias_bound",  # upper bound on how much any ticket's odds differ from 1 / total, relatively
+        "addresses",  # AddressStats, most suspicious (largest |z_score|) first
+    ],
+)
+
+
+class AddressBook:
+    """Hands out a small integer id per address, so batches carry ints
+    instead of strings."""
+
+    def __init__(self):
+        self.addresses = []
+        self._ids = {}
+
+    def id(self, address):
+        key = address.lower()
+        if key not in self._ids:
+            self._ids[key] = len(self.addresses)
+            self.addresses.append(address)
+        return self._ids[key]
+
+    def __len__(self):
+        return len(self.addresses)
+
+
+def indexed_batches(lottery_address, book, db_path=None, batch_rounds=BATCH_ROUNDS):
+    """Streams every paid out round of `lottery_address` from the
+    "scripts/lottery_indexer.py" database, oldest first."""
+    db_path = Path(db_path if db_path else config.get("indexer_db", INDEXER_DB))
+    db = sqlite3.connect(str(db_path))
+    try:
+        payouts = db.execute(
+            "SELECT round, winner, randomness FROM payouts WHERE lottery = ? ORDER BY round",
+            (str(lottery_address),),
+        )
+        entries = db.execute(
+            "SELECT round, player, cumulative_tickets FROM entries "
+            "WHERE lottery = ? ORDER BY round, block_number, log_index",
+            (str(lottery_address),),
+        )
+        batch = RoundBatch([], [], [], [], bytearray(), [])
+        entry = next(entries, None)
+        for round, winner, randomness in payouts:
+            count = 0
+            while entry is not None and entry[0] <= round:
+                if entry[0] == round:
+                    batch.cumulative.append(entry[2])
+                    batch.players.append(book.id(entry[1]))
+                    count += 1
+                entry = next(entries, None)
+            if count == 0:
+                continue  # a payout without indexed entries, nothing we can check
+            batch.rounds.append(round)
+            batch.counts.append(count)
+            batch.randomness.extend(int(randomness, 16).to_bytes(32, "big"))
+            batch.recorded.append(book.id(winner))
+            if len(batch.rounds) == batch_rounds:
+                yield batch
+                batch = RoundBatch([], [], [], [], bytearray(), [])
+        if batch.rounds:
+            yield batch
+    finally:
+        db.close()
+
+
+def synthetic_batches(
+    count, book, players=10, max_tickets=5, addresses=100, seed=0, batch_rounds=BATCH_ROUNDS
+):
+    """Random rounds from a known fair source of randomness, `players`
+    purchases of 1 to `max_tickets` tickets each, for load testing the auditor
+    and sanity checking its expectations. They have no recorded winners."""
+    ids = [book.id(f"0x{i:040x}") for i in range(1, addresses + 1)]
+    for start in range(0, count, batch_rounds):
+        n = min(batch_rounds, count - start)
+        if np is not None:
+            rng = np.random.default_rng([seed, start])
+            tickets = rng.integers(1, max_tickets + 1, size=(n, players))
+            yield RoundBatch(
+                np.arange(start, start + n),
+                np.full(n, players),
+                np.cumsum(tickets, axis=1).ravel(),
+                np.asarray(ids)[rng.integers(0, addresses, size=n * players)],
+                rng.integers(0, 2**32, size=(n, LIMBS), dtype=np.uint32).astype(">u4").tobytes(),
+                np.full(n, NO_WINNER),
+            )
+            continue
+        rng = random.Random(f"{seed}:{start}")
+        cumulative = []
+        for _ in range(n):
+            total = 0
+            for _ in range(players):
+                total += rng.randint(1, max_tickets)
+                cumulative.append(total)
+        yield RoundBatch(
+            list(range(start, start + n)),
+            [players] * n,
+            cumulative,
+            [rng.choice(ids) for _ in range(n * players)],
+            b"".join(rng.getrandbits(256).to_bytes(32, "big") for _ in range(n)),
+            [NO_WINNER] * n,
+        )
+
+
+class _Totals:
+    # what we add up over every batch, one slot per address id
+    def __init__(self):
+        self.rounds, self.tickets, self.wins = [], [], []
+        self.expected, self.variance = [], []
+        self.count = self.checked = self.mismatch_count = self.max_total = 0
+        self.mismatches = []
+
+    def grow(self, size):
+        for column in (self.rounds, self.tickets, self.wins, self.expected, self.variance):
+            column.extend([0] * (size - len(column)))
+
+    def mismatch(self, round, expected, recorded):
+        self.mismatch_count += 1
+        if len(self.mismatches) < MAX_REPORTED_MISMATCHES:
+            self.mismatches.append((round, expected, recorded))
+
+
+def _audit_batch_python(batch, totals):
+    start = 0
+    for i, count in enumerate(batch.counts):
+        end = start + count
+        cumulative = batch.cumulative[start:end]
+        players = batch.players[start:end]
+        total = int(cumulative[-1])
+        randomness = int.from_bytes(batch.randomness[32 * i : 32 * i + 32], "big")
+        winner = players[bisect_right(cumulative, randomness % total)]
+        totals.count += 1
+        totals.max_total = max(totals.max_total, total)
+        totals.wins[winner] += 1
+        if batch.recorded[i] != NO_WINNER:
+            totals.checked += 1
+            if batch.recorded[i] != winner:
+                totals.mismatch(batch.rounds[i], winner, batch.recorded[i])
+        # an address' chance this round is all of its tickets over the total, however many purchases they came in
+        chances, previous = {}, 0
+        for player, running in zip(players, cumulative):
+            chances[player] = chances.get(player, 0) + running - previous
+            previous = running
+        for player, tickets in chances.items():
+            p = tickets / total
+            totals.rounds[player] += 1
+            totals.tickets[player] += tickets
+            totals.expected[player] += p
+            totals.variance[player] += p * (1 - p)
+        start = end
+
+
+def winner_positions_numpy(counts, cumulative, randomness):
+    """The winning purchase of every round of a batch, as a position in the
+    batch's flat purchase columns."""
+    first = np.zeros(len(counts), dtype=np.int64)
+    np.cumsum(counts[:-1], out=first[1:])
+    totals = cumulative[first + counts - 1]
+    positions = np.zeros(len(counts), dtype=np.int64)
+    small = totals < 2**LIMB_BITS
+    if small.any():
+        total = totals[small].astype(np.uint64)
+        limbs = np.frombuffer(randomness, dtype=">u4").reshape(-1, LIMBS)[small].astype(np.uint64)
+        ticket = np.zeros(len(total), dtype=np.uint64)
+        for limb in range(LIMBS):
+            # "ticket" < total < 2**32, so "ticket << 32 | limb" always fits in 64 bits
+            ticket = ((ticket << np.uint64(LIMB_BITS)) | limbs[:, limb]) % total
+        # one sorted array for all of these rounds: each round's running totals are shifted past the previous round's
+        in_small = np.repeat(small, counts)
+        shifted = np.zeros(len(total), dtype=np.int64)
+        np.cumsum(total[:-1].astype(np.int64), out=shifted[1:])
+        running = cumulative[in_small] + np.repeat(shifted, counts[small])
+        found = np.searchsorted(running, shifted + ticket.astype(np.int64), side="right")
+        # "found" counts purchases of small rounds only, map it back onto the batch's columns
+        positions[small] = np.flatnonzero(in_small)[found]
+    for i in np.flatnonzero(~small):
+        # 2**32 tickets or more don't fit the uint64 reduction, those rounds are done with Python integers
+        start, end = first[i], first[i] + counts[i]
+        ticket = int.from_bytes(randomness[32 * i : 32 * i + 32], "big") % int(totals[i])
+        positions[i] = start + bisect_right(cumulative[start:end].tolist(), ticket)
+    return positions, totals
+
+
+def _audit_batch_numpy(batch, totals, size):
+    counts = np.asarray(batch.counts, dtype=np.int64)
+    cumulative = np.asarray(batch.cumulative, dtype=np.int64)
+    players = np.asarray(batch.players, dtype=np.int64)
+    recorded = np.asarray(batch.recorded, dtype=np.int64)
+    positions, round_totals = winner_positions_numpy(counts, cumulative, bytes(batch.randomness))
+    winners = players[positions]
+
+    totals.count += len(counts)
+    totals.max_total = max(totals.max_total, int(round_totals.max()))
+    checked = recorded != NO_WINNER
+    totals.checked += int(checked.sum())
+    for i in np.flatnonzero(checked & (recorded != winners)):
+        totals.mismatch(int(batch.rounds[i]), int(winners[i]), int(recorded[i]))
+
+    # tickets per purchase are the steps of the running totals, restarting at every round
+    round_of = np.repeat(np.arange(len(counts)), counts)
+    tickets = np.diff(cumulative, prepend=0)
+    first = np.zeros(len(counts), dtype=np.int64)
+    np.cumsum(counts[:-1], out=first[1:])
+    tickets[first] = cumulative[first]
+    # an address' chance this round is all of its tickets over the total, however many purchases they came in
+    pairs, pair_of = np.unique(round_of * size + players, return_inverse=True)
+    chance = np.bincount(pair_of, weights=tickets) / round_totals[pairs // size]
+    address = pairs % size
+    for column, values in (
+        (totals.rounds, np.bincount(address, minlength=size)),
+        (totals.tickets, np.bincount(players, weights=tickets, minlength=size)),
+        (totals.wins, np.bincount(winners, minlength=size)),
+        (totals.expected, np.bincount(address, weights=chance, minlength=size)),
+        (totals.variance, np.bincount(address, weights=chance * (1 - chance), minlength=size)),
+    ):
+        column[:] = (np.asarray(column) + values).tolist()
+
+
+def audit(batches, book, use_numpy=None):
+    """Replays the winner of every round in `batches` (from
+    "indexed_batches()" or "synthetic_batches()" with the same `book`) and
+    compares it with the recorded one.
+        Args:
+            use_numpy (bool): defaults to True when numpy is installed
+        Returns:
+            AuditReport
+    """
+    use_numpy = np is not None if use_numpy is None else use_numpy
+    if use_numpy and np is None:
+        raise ImportError("numpy is not installed, run 'pip install numpy'")
+    totals = _Totals()
+    for batch in batches:
+        size = len(book)
+        totals.grow(size)
+        try:
+            if use_numpy:
+                _audit_batch_numpy(batch, totals, size)
+                continue
+        except OverflowError:
+            pass  # running totals of 2**63 tickets or more don't fit int64 columns
+        _audit_batch_python(batch, totals)
+    totals.grow(len(book))
+    addresses = [
+        AddressStats(
+            book.addresses[i],
+            int(totals.rounds[i]),
+            int(totals.tickets[i]),
+            int(totals.wins[i]),
+            totals.expected[i],
+            (totals.wins[i] - totals.expected[i]) / math.sqrt(totals.variance[i])
+            if totals.variance[i] > 0
+            else 0.0,
+        )
+        for i in range(len(book))
+        if totals.rounds[i]
+    ]
+    addresses.sort(key=lambda s: abs(s.z_score), reverse=True)
+    # every ticket's odds are floor(2**256 / total) or ceil(2**256 / total) out of 2**256, so they differ from
+    # 1 / total by less than total / 2**256 relatively, which is largest for the largest round
+    return AuditReport(
+        totals.count,
+        totals.checked,
+        totals.mismatch_count,
+        [
+            (round, book.addresses[expected], book.addresses[recorded])
+            for round, expected, recorded in totals.mismatches
+        ],
+        totals.max_total,
+        totals.max_total / 2**256,
+        addresses,
+    )
+
+
+def print_report(report, top=10):
+    print(f"{'rounds':<20}{report.rounds}")
+    print(f"{'checked':<20}{report.checked}")
+    print(f"{'mismatches':<20}{report.mismatch_count}")
+    print(f"{'max total tickets':<20}{report.max_total_tickets}")
+    print(f"{'modulo bias bound':<20}{report.modulo_bias_bound:.3g}")
+    for round, expected, recorded in report.mismatches:
+        print(f"MISMATCH round {round}: expected {expected}, recorded {recorded}")
+    print(f"{'address':<44}{'rounds':>8}{'tickets':>10}{'wins':>8}{'expected':>10}{'z':>8}")
+    for s in report.addresses[:top]:
+        print(
+            f"{s.address:<44}{s.rounds:>8}{s.tickets:>10}{s.wins:>8}{s.expected_wins:>10.2f}{s.z_score:>8.2f}"
+        )
+
+
+def main(source="indexed", count=None):
+    book = AddressBook()
+    if source == "synthetic":
+        batches = synthetic_batches(int(count) if count else 100000, book)
+    else:
+        batches = indexed_batches(Lottery[-1].address, book)
+    report = audit(batches, book)
+    print_report(report)
+    if report.mismatch_count:
+        raise SystemExit(1)
@@ -7,10 +7,22 @@ from brownie import (
     LinkToken,
     Contract,
     interface,
+    web3,
 )
+from scripts.deployment_registry import (
+    cached_contract,
+    load_contract,
+    register_contract,
+)
+from collections import namedtuple
+from hexbytes import HexBytes
+import time
 
 FORKED_LOCAL_ENVIRONMENTS = ["mainnet-fork", "mainnet-fork-dev"]
 LOCAL_BLOCKCHAIN_ENVIRONMENTS = ["development", "ganache-local"]
+# local chains that outlive a run, so their mocks are worth remembering in the on-disk deployment registry. "development"
+# is a fresh chain every session (and one per xdist worker), so its mocks are only cached in-process.
+PERSISTENT_LOCAL_ENVIRONMENTS = ["ganache-local"]
 
 # below function code taken from the last project
 def get_account(index=None, id=None):
@@ -57,15 +69,23 @@ def get_contract(contract_name):
     contract_type = contract_to_mock[contract_name]
     # Now we need to check that do we actually even need to deploy a "Mock" and we'll skip the "FORKED_LOCAL_ENVIRONMENTS" because again we don't need to deploy a "Mock price_feed address" on a "FORKED_LOCAL_ENVIRONMENTS"
     if network.show_active() in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        # First we ask the deployment registry, which remembers mocks from earlier runs against the same chain
+        contract = load_contract(contract_name, contract_type)
+        if contract is not None:
+            return contract
         if len(contract_type) <= 0:
             # above is equivalent to doing something like "MockV3Aggregator.length". We're cchecking how many "MockV3Aggregators" have actually been deployed, if none have been deployed we're going ahead and deploy them
             deploy_mocks()
         # NOw we'er going to get that deployed "Mock" Contract i.e similar like grabbing recently deployed MockV3Aggregator (or "MockV3Aggregator[-1]")
         contract = contract_type[-1]
+        register_contract(contract_name, contract, persist=_persist_mocks())
 
     # Above part will work perfetly for our Development Context but however we're not alway's going to just want to deploy to a development network we'er also going to want to deploy to testnets. So then we'll say "else"
     # and in this way we just grab that contract from the running config for example
     else:
+        contract = cached_contract(contract_name)
+        if contract is not None:
+            return contract
         contract_address = config["networks"][network.show_active()][contract_name]
         # address
         # ABI
@@ -73,6 +93,7 @@ def get_contract(contract_name):
             contract_type._name, contract_address, contract_type.abi
         )
         # MockV3Aggregator.abi
+        register_contract(contract_name, contract, persist=False)
     return contract
 
 
@@ -80,20 +101,94 @@ DECIMALS = 8
 INITIAL_VALUE = 200000000000
 
 
-def deploy_mocks(decimals=DECIMALS, initial_value=INITIAL_VALUE):
+# How our "VRFCoordinatorMock" answers randomness requests (the values of its "FulfillMode" enum):
+# "manual" waits for us to call "callBackWithRandomness()" like in the unit tests, "same_block" calls the lottery back
+# inside the "endLottery()" transaction, and "next_block" answers everything queued on the next "fulfillPending()".
+VRF_FULFILL_MODES = {"manual": 0, "same_block": 1, "next_block": 2}
+VRF_RANDOMNESS_SEED = 777
+
+
+def _persist_mocks():
+    return network.show_active() in PERSISTENT_LOCAL_ENVIRONMENTS
+
+
+def deploy_mocks(
+    decimals=DECIMALS, initial_value=INITIAL_VALUE, fulfill_mode=None, seed=None
+):
     account = get_account()
-    MockV3Aggregator.deploy(decimals, initial_value, {"from": account})
+    price_feed = MockV3Aggregator.deploy(decimals, initial_value, {"from": account})
     link_token = LinkToken.deploy({"from": account})
-    VRFCoordinatorMock.deploy(link_token.address, {"from": account})
+    vrf_coordinator = VRFCoordinatorMock.deploy(link_token.address, {"from": account})
+    persist = _persist_mocks()
+    register_contract("eth_usd_price_feed", price_feed, persist=persist)
+    register_contract("link_token", link_token, persist=persist)
+    register_contract("vrf_coordinator", vrf_coordinator, persist=persist)
+    fulfill_mode = (
+        fulfill_mode
+        if fulfill_mode
+        else config["networks"][network.show_active()].get("vrf_fulfill_mode", "manual")
+    )
+    if fulfill_mode != "manual":
+        set_vrf_fulfill_mode(fulfill_mode, seed, vrf_coordinator)
     print("Deployed!")
 
 
+def set_vrf_fulfill_mode(mode, seed=None, vrf_coordinator=None):
+    """Switches the local "VRFCoordinatorMock" between answering requests by
+    hand ("manual") and by itself ("same_block" or "next_block"). The auto
+    answers are derived from `seed`, so the same seed replays the same winners.
+    """
+    vrf_coordinator = vrf_coordinator if vrf_coordinator else get_contract("vrf_coordinator")
+    seed = (
+        seed
+        if seed is not None
+        else config["networks"][network.show_active()].get(
+            "vrf_randomness_seed", VRF_RANDOMNESS_SEED
+        )
+    )
+    tx = vrf_coordinator.setFulfillMode(
+        VRF_FULFILL_MODES[mode], seed, {"from": get_account()}
+    )
+    tx.wait(1)
+    return tx
+
+
+def fulfill_pending_requests():
+    """On local networks, answers the requests the mock has queued (its
+    "next_block" mode, or "same_block" callbacks that couldn't run in the
+    request transaction). Returns the transaction, or None if there was nothing
+    to answer."""
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        return None
+    vrf_coordinator = get_contract("vrf_coordinator")
+    if vrf_coordinator.pendingRequestCount() == 0:
+        return None
+    tx = vrf_coordinator.fulfillPending({"from": get_account()})
+    tx.wait(1)
+    return tx
+
+
 def fund_with_link(
-    contract_address, account=None, link_token=None, amount=100000000000000000
+    contract_address,
+    account=None,
+    link_token=None,
+    amount=100000000000000000,
+    engine=None,
+    after=(),
 ):
     # amount = 0.1 LINK or 100000000000000000
+    # With an "engine" (scripts/tx_engine.py) we only submit the transfer and return its Future, so the caller can
+    # chain on it (e.g. "endLottery()" with "after=[future]") instead of waiting here.
     account = account if account else get_account()
     link_token = link_token if link_token else get_contract("link_token")
+    if engine:
+        return engine.submit(
+            link_token.transfer,
+            contract_address,
+            amount,
+            tx_params={"from": account},
+            after=after,
+        )
     tx = link_token.transfer(contract_address, amount, {"from": account})
     # Other way to "transfer" LINK Token directly on the Contract, is by this using the "interfaces folder" to actually interact with some contracts
     # Right now we have our "Mock" `LinkToken.sol` in here which have all the definations and functionalities in it.
@@ -113,3 +208,220 @@ def fund_with_link(
     # If we have the ABI we can just pop it into contract using "Contract.from_abi()" with address and ABI...
     # ..but if we have interface we don't even need to compile down to the ABI ourselves because brownie is smart enough to know that it can compile down to ABI itself
     # and we can just work directly with that interface which is incredibly powerful.
+
+
+# Instead of sending a fixed 0.1 LINK before every "endLottery()", we only top the contract up when its LINK balance
+# can't pay for the next request, and then we send enough for "link_rounds_to_fund" requests at once.
+LINK_ROUNDS_TO_FUND = 1
+
+link_funding_metrics = {
+    "checks": 0,  # balance checks, one per round we were asked to fund
+    "transfers": 0,  # LINK transfers we actually sent
+    "link_transferred": 0,
+}
+
+
+def ensure_link_funded(
+    contract_address,
+    fee=None,
+    rounds=None,
+    account=None,
+    link_token=None,
+    engine=None,
+    after=(),
+):
+    """Makes sure `contract_address` holds at least `fee` LINK, topping it up
+    to `fee * rounds` if it doesn't.
+        Args:
+            fee (int): LINK needed for the next request(s), defaults to the
+            network's "fee"
+            rounds (int): how many requests a top-up should cover, defaults to
+            the network's "link_rounds_to_fund"
+            engine (TxEngine): if given the top-up is only submitted, and the
+            balance is checked once `after` has confirmed and the engine is
+            about to send it
+        Returns:
+            the LINK transfer, None if the contract already had enough LINK.
+            With an engine a Future for either of those.
+    """
+    network_config = config["networks"][network.show_active()]
+    fee = fee if fee is not None else network_config["fee"]
+    rounds = (
+        rounds
+        if rounds is not None
+        else network_config.get("link_rounds_to_fund", LINK_ROUNDS_TO_FUND)
+    )
+    account = account if account else get_account()
+    link_token = link_token if link_token else get_contract("link_token")
+    if engine:
+        # checked at submit time, the balance could still miss an earlier top-up or not yet show the fee of an
+        # earlier "endLottery()", so we only look at it right before sending
+        top_up = {"amount": 0, "tx": None}
+
+        def send_top_up(tx_params):
+            top_up["amount"] = _link_top_up_amount(
+                contract_address, fee, rounds, link_token
+            )
+            if top_up["amount"] == 0:
+                return None
+            top_up["tx"] = link_token.transfer(
+                contract_address, top_up["amount"], tx_params
+            )
+            return top_up["tx"]
+
+        future = engine.submit(send_top_up, tx_params={"from": account}, after=after)
+        _link_top_ups.setdefault(contract_address, []).append((future, top_up))
+        return future
+    amount = _link_top_up_amount(contract_address, fee, rounds, link_token)
+    if amount == 0:
+        return None
+    return fund_with_link(contract_address, account, link_token, amount)
+
+
+# contract address -> [(Future, {"amount": ..., "tx": ...})] of the engine top-ups, so one that has been sent but not
+# mined yet counts as LINK the contract is about to have instead of being sent twice
+_link_top_ups = {}
+
+
+def _link_in_flight(contract_address):
+    top_ups = [
+        (future, top_up)
+        for future, top_up in _link_top_ups.get(contract_address, [])
+        if not future.done()
+    ]
+    _link_top_ups[contract_address] = top_ups
+    # once mined the balance has it already
+    return sum(
+        top_up["amount"]
+        for _, top_up in top_ups
+        if top_up["tx"] is not None and top_up["tx"].block_number is None
+    )
+
+
+def _link_top_up_amount(contract_address, fee, rounds, link_token):
+    # 0 if the contract can pay `fee` already
+    balance = link_token.balanceOf(contract_address) + _link_in_flight(
+        contract_address
+    )
+    link_funding_metrics["checks"] += 1
+    if balance >= fee:
+        return 0
+    amount = fee * max(rounds, 1) - balance
+    link_funding_metrics["transfers"] += 1
+    link_funding_metrics["link_transferred"] += amount
+    return amount
+
+
+def link_funding_savings():
+    # every check that didn't need a transfer is a transaction (and a block of waiting) we saved
+    return {
+        **link_funding_metrics,
+        "transfers_saved": link_funding_metrics["checks"]
+        - link_funding_metrics["transfers"],
+    }
+
+
+# How long we wait for the "Chainlink Node" to call back "fulfillRandomness()" unless the network config says otherwise
+FULFILLMENT_TIMEOUT = 300
+# "Lottery" and "LotteryManager" both emit this, with the "requestId" indexed as topic 1
+FULFILLED_SIGNATURE = "RandomnessFulfilled(bytes32,address,uint256)"
+
+Fulfillment = namedtuple(
+    "Fulfillment", ["winner", "randomness", "block_number", "transaction_hash"]
+)
+
+
+def wait_for_fulfillment(
+    lottery, request_tx, timeout=None, poll_interval=1, max_poll_interval=15
+):
+    """Waits for the VRF callback that answers the randomness request made in
+    `request_tx` (the "endLottery()" transaction) and returns as soon as the
+    matching "RandomnessFulfilled" event is on chain.
+        Args:
+            lottery (brownie.network.contract.ProjectContract)
+            request_tx (brownie.network.transaction.TransactionReceipt)
+            timeout (int): seconds to wait, defaults to the network's
+            "fulfillment_timeout" or FULFILLMENT_TIMEOUT
+            poll_interval (int): first delay between polls, doubled while no
+            new block shows up, up to max_poll_interval
+        Returns:
+            Fulfillment: winner, randomness, block_number, transaction_hash
+        Raises:
+            TimeoutError: if the callback hasn't landed within "timeout"
+    """
+    request_id = request_tx.events["RequestedRandomness"]["requestId"]
+    fulfillments = wait_for_fulfillments(
+        lottery,
+        [request_id],
+        request_tx.block_number,
+        timeout=timeout,
+        poll_interval=poll_interval,
+        max_poll_interval=max_poll_interval,
+    )
+    return fulfillments[HexBytes(request_id).hex()]
+
+
+def wait_for_fulfillments(
+    contract,
+    request_ids,
+    from_block,
+    timeout=None,
+    poll_interval=1,
+    max_poll_interval=15,
+):
+    """Same as "wait_for_fulfillment()" but for many requests at once, e.g. all
+    the rounds ended by "LotteryManager.endLotteries()".
+        Returns:
+            dict: request id (hex string) -> Fulfillment
+    """
+    if timeout is None:
+        timeout = config["networks"][network.show_active()].get(
+            "fulfillment_timeout", FULFILLMENT_TIMEOUT
+        )
+    pending = {HexBytes(request_id).hex() for request_id in request_ids}
+    fulfillments = {}
+    event = web3.eth.contract(
+        address=contract.address, abi=contract.abi
+    ).events.RandomnessFulfilled
+    fulfilled_topic = web3.keccak(text=FULFILLED_SIGNATURE).hex()
+    # the callbacks can't land before the requests, so we only ever scan forward from the requests' block
+    deadline = time.time() + timeout
+    interval = poll_interval
+    while True:
+        latest_block = web3.eth.block_number
+        if latest_block >= from_block:
+            # one "eth_getLogs" per poll for all the requests we're still waiting on: the node matches the indexed
+            # "requestId" against the OR-list of our pending ids, so other rounds' callbacks never come back to us
+            logs = web3.eth.get_logs(
+                {
+                    "address": contract.address,
+                    "fromBlock": from_block,
+                    "toBlock": latest_block,
+                    "topics": [fulfilled_topic, sorted(pending)],
+                }
+            )
+            for log in logs:
+                log = event().processLog(log)
+                request_id = HexBytes(log.args.requestId).hex()
+                if request_id in pending:
+                    pending.remove(request_id)
+                    fulfillments[request_id] = Fulfillment(
+                        log.args.winner,
+                        log.args.randomness,
+                        log.blockNumber,
+                        log.transactionHash.hex(),
+                    )
+            if not pending:
+                return fulfillments
+            # new blocks arrived but not every callback yet, so poll quickly again
+            from_block = latest_block + 1
+            interval = poll_interval
+        else:
+            # no new block since the last poll, back off
+            interval = min(interval * 2, max_poll_interval)
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise TimeoutError(
+                f"No fulfillment for {len(pending)} request(s) after {timeout} seconds"
+            )
+        time.sleep(min(interval, remaining))
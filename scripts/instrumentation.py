@@ -0,0 +1,281 @@
+from brownie import history, web3
+from brownie.network.transaction import TransactionReceipt
+from scripts.tx_engine import TxEngine
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+import importlib
+import json
+import sys
+import time
+
+# Opt-in tracing for the scripts: while a "Tracer" is installed every RPC request is counted by method, and the entry
+# points in "TRACED_FUNCTIONS" become "steps" that record their wall time, the gas of the transactions they sent, the
+# blocks that went by and the RPC calls they made. Every finished step is written as one JSON line, and
+# "print_summary()" adds them up per step name.
+#   brownie run scripts/instrumentation.py                      -> traces "deploy_lottery.main()" into TRACE_PATH
+#   brownie run scripts/instrumentation.py main build/run.jsonl
+#   tracer = instrument("build/trace.jsonl"); ...; tracer.print_summary(); tracer.uninstall()
+# Steps nest (e.g. "get_contract" inside "deploy_lottery"), a step's numbers include everything its inner steps did.
+# A transaction belongs to the steps that sent it. One submitted to a "TxEngine" belongs to the steps that submitted it,
+# even though the engine only sends it later (e.g. from inside another step's "TxEngine.wait()"). A step that returns
+# while its transactions are still pending is written once they have confirmed, with their gas and the blocks up to
+# the last confirmation. The wait steps ("tx.wait", "TxEngine.wait") also count the transactions they waited on.
+
+TRACE_PATH = "build/trace.jsonl"
+MIDDLEWARE_NAME = "lottery_rpc_counter"
+
+# (module, function or "Class.method") for every entry point we wrap
+TRACED_FUNCTIONS = [
+    ("scripts.helpful_scripts", "deploy_mocks"),
+    ("scripts.helpful_scripts", "get_contract"),
+    ("scripts.helpful_scripts", "fund_with_link"),
+    ("scripts.helpful_scripts", "ensure_link_funded"),
+    ("scripts.helpful_scripts", "wait_for_fulfillment"),
+    ("scripts.entrance_fee", "get_entrance_fee"),
+    ("scripts.deploy_lottery", "deploy_lottery"),
+    ("scripts.deploy_lottery", "start_lottery"),
+    ("scripts.deploy_lottery", "enter_lottery"),
+    ("scripts.deploy_lottery", "end_lottery"),
+    ("scripts.tx_engine", "TxEngine.wait"),
+]
+WAIT_STEPS = ("tx.wait", "TxEngine.wait")
+
+
+def _receipts(value):
+    values = value if isinstance(value, (list, tuple)) else [value]
+    return [item for item in values if isinstance(item, TransactionReceipt)]
+
+
+class Tracer:
+    def __init__(self, path=None):
+        self.path = Path(path if path else TRACE_PATH)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = self.path.open("a")
+        self.rpc_calls = Counter()  # method -> requests, for the whole run
+        self.records = []
+        self._stack = []
+        self._paused = False
+        self._patched = []  # (owner, attribute, original) to undo in "uninstall()"
+        self._engine_txids = set()  # sent by a "TxEngine", they belong to whoever submitted them
+        self._engine_txs = {}  # "TxEngine" future -> {txid: TransactionReceipt} once sent
+        self._unconfirmed = []  # finished steps still waiting on their transactions
+
+    def _middleware(self, make_request, w3):
+        def middleware(method, params):
+            if not self._paused:
+                self.rpc_calls[method] += 1
+                for frame in self._stack:
+                    frame["rpc_calls"][method] += 1
+            return make_request(method, params)
+
+        return middleware
+
+    def _block_number(self):
+        # our own bookkeeping shouldn't show up in the counts
+        self._paused = True
+        try:
+            return web3.eth.block_number
+        finally:
+            self._paused = False
+
+    @contextmanager
+    def step(self, name):
+        frame = {
+            "step": name,
+            "parent": self._stack[-1]["step"] if self._stack else None,
+            "rpc_calls": Counter(),
+            "first_tx": len(history),
+            "first_block": self._block_number(),
+            "futures": [],  # "TxEngine" submissions made while this step ran
+            "waited": [],  # receipts a wait step waited on
+        }
+        self._stack.append(frame)
+        started = time.perf_counter()
+        error = None
+        try:
+            yield frame
+        except BaseException as exc:
+            error = repr(exc)
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            self._stack.pop()
+            self._paused = True
+            try:
+                # the engine's transactions sent while we ran belong to whoever submitted them, see "_track_jobs()"
+                sent = [
+                    tx
+                    for tx in list(history)[frame["first_tx"] :]
+                    if tx.txid not in self._engine_txids
+                ]
+            finally:
+                self._paused = False
+            self._unconfirmed.append(
+                (
+                    frame,
+                    sent,
+                    {
+                        "step": name,
+                        "parent": frame["parent"],
+                        "started_at": time.time() - seconds,
+                        "seconds": seconds,
+                        # filled in by "_record_confirmed()"
+                        "gas_used": None,
+                        "transactions": None,
+                        "blocks_waited": None,
+                        "last_block": self._block_number(),
+                        "rpc_calls": dict(frame["rpc_calls"]),
+                        "error": error,
+                    },
+                )
+            )
+            self._record_confirmed()
+
+    def _transactions(self, frame, sent):
+        # every transaction of the step once, mined ones only (a replaced transaction's dropped originals never are)
+        transactions = {tx.txid: tx for tx in sent + frame["waited"]}
+        for future in frame["futures"]:
+            transactions.update(self._engine_txs.get(future, {}))
+        return [tx for tx in transactions.values() if tx.block_number is not None]
+
+    def _record_confirmed(self, final=False):
+        # writes every finished step whose transactions have all confirmed, or all of them when `final`
+        still_unconfirmed = []
+        for frame, sent, record in self._unconfirmed:
+            confirmed = all(future.done() for future in frame["futures"]) and all(
+                tx.block_number is not None for tx in sent + frame["waited"]
+            )
+            if not (confirmed or final):
+                still_unconfirmed.append((frame, sent, record))
+                continue
+            transactions = self._transactions(frame, sent)
+            last_block = max(
+                [record.pop("last_block")] + [tx.block_number for tx in transactions]
+            )
+            record["gas_used"] = sum(tx.gas_used or 0 for tx in transactions)
+            record["transactions"] = len(transactions)
+            record["blocks_waited"] = last_block - frame["first_block"]
+            self._record(record)
+        self._unconfirmed = still_unconfirmed
+
+    def _record(self, record):
+        self.records.append(record)
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def traced(self, name, fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self.step(name) as frame:
+                result = fn(*args, **kwargs)
+                if name in WAIT_STEPS:
+                    frame["waited"].extend(_receipts(args[0]) + _receipts(result))
+                return result
+
+        return wrapper
+
+    def _track_jobs(self):
+        # every "TxEngine" submission remembers the steps it was made in, and its transactions are theirs whenever
+        # (and from inside whichever step) the engine gets around to sending them
+        tracer = self
+        engine_submit = TxEngine.submit
+        engine_send = TxEngine._send
+
+        def submit(engine, *args, **kwargs):
+            future = engine_submit(engine, *args, **kwargs)
+            for frame in tracer._stack:
+                frame["futures"].append(future)
+            return future
+
+        def send(engine, job, *args, **kwargs):
+            try:
+                return engine_send(engine, job, *args, **kwargs)
+            finally:
+                tracer._engine_txids.update(job.txs)
+                tracer._engine_txs[job.future] = job.txs
+
+        self._patch(TxEngine, "submit", submit)
+        self._patch(TxEngine, "_send", send)
+
+    def _patch(self, owner, attribute, replacement):
+        self._patched.append((owner, attribute, getattr(owner, attribute)))
+        setattr(owner, attribute, replacement)
+
+    def install(self, functions=TRACED_FUNCTIONS):
+        """Adds the RPC counter to web3 and wraps `functions`, including the
+        copies other "scripts." modules got through "from ... import ..."."""
+        web3.middleware_onion.add(self._middleware, name=MIDDLEWARE_NAME)
+        self._track_jobs()
+        for module_name, attribute in functions:
+            module = importlib.import_module(module_name)
+            if "." in attribute:
+                class_name, method = attribute.split(".")
+                owner = getattr(module, class_name)
+                self._patch(owner, method, self.traced(attribute, getattr(owner, method)))
+                continue
+            original = getattr(module, attribute)
+            wrapper = self.traced(attribute, original)
+            for name, loaded in list(sys.modules.items()):
+                if (name == "scripts" or name.startswith("scripts.")) and getattr(
+                    loaded, attribute, None
+                ) is original:
+                    self._patch(loaded, attribute, wrapper)
+        self._patch(TransactionReceipt, "wait", self.traced("tx.wait", TransactionReceipt.wait))
+        return self
+
+    def uninstall(self):
+        # steps whose transactions never confirmed are written with what did
+        self._record_confirmed(final=True)
+        for owner, attribute, original in reversed(self._patched):
+            setattr(owner, attribute, original)
+        self._patched = []
+        web3.middleware_onion.remove(MIDDLEWARE_NAME)
+        self._file.close()
+
+    def summary(self):
+        """Totals per step name: calls, seconds, gas, transactions, blocks and
+        RPC calls, slowest first."""
+        self._record_confirmed()
+        steps = {}
+        for record in self.records:
+            total = steps.setdefault(
+                record["step"],
+                {"calls": 0, "seconds": 0.0, "gas_used": 0, "transactions": 0, "blocks_waited": 0, "rpc_calls": 0},
+            )
+            total["calls"] += 1
+            for key in ("seconds", "gas_used", "transactions", "blocks_waited"):
+                total[key] += record[key]
+            total["rpc_calls"] += sum(record["rpc_calls"].values())
+        return sorted(steps.items(), key=lambda item: item[1]["seconds"], reverse=True)
+
+    def print_summary(self):
+        print(f"{'step':<24}{'calls':>6}{'seconds':>10}{'gas':>12}{'txs':>6}{'blocks':>8}{'rpc':>7}")
+        for name, total in self.summary():
+            print(
+                f"{name:<24}{total['calls']:>6}{total['seconds']:>10.3f}{total['gas_used']:>12}"
+                f"{total['transactions']:>6}{total['blocks_waited']:>8}{total['rpc_calls']:>7}"
+            )
+        print(f"{'rpc method':<32}{'calls':>8}")
+        for method, calls in self.rpc_calls.most_common():
+            print(f"{method:<32}{calls:>8}")
+
+
+def instrument(path=None, functions=TRACED_FUNCTIONS):
+    return Tracer(path).install(functions)
+
+
+def main(trace_path=TRACE_PATH):
+    # imported before "instrument()", so the names it imported from the other scripts get wrapped too
+    from scripts import deploy_lottery
+
+    tracer = instrument(trace_path)
+    try:
+        with tracer.step("main"):
+            deploy_lottery.main()
+    finally:
+        # "uninstall()" also writes the steps still waiting on a transaction
+        tracer.uninstall()
+        tracer.print_summary()
+    print(f"Trace written to {tracer.path}")
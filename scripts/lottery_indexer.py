@@ -0,0 +1,241 @@
+from brownie import Lottery, network, config, web3
+from pathlib import Path
+from web3.exceptions import BlockNotFound
+import sqlite3
+
+# Streams "LotteryEntered" and "WinnerPaid" logs into a local SQLite file, so questions like "all entries of round N" or
+# "payout history for address X" are answered from the index instead of thousands of "players(round, i)" calls.
+#   brownie run scripts/lottery_indexer.py
+# Every run resumes from the last indexed block. We remember the hashes of the most recent "confirmations" blocks, and
+# if one of them changed (a reorg), everything above the confirmed depth is thrown away and indexed again.
+
+INDEXER_DB = "build/lottery_index.sqlite"
+CHUNK_SIZE = 2000  # blocks per "eth_getLogs" request
+CONFIRMATIONS = 12  # blocks after which we consider a block final
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cursor (
+    lottery TEXT PRIMARY KEY,
+    last_block INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blocks (
+    lottery TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    block_hash TEXT NOT NULL,
+    PRIMARY KEY (lottery, block_number)
+);
+CREATE TABLE IF NOT EXISTS entries (
+    lottery TEXT NOT NULL,
+    round INTEGER NOT NULL,
+    player TEXT NOT NULL,
+    tickets INTEGER NOT NULL,
+    cumulative_tickets INTEGER NOT NULL,
+    block_number INTEGER NOT NULL,
+    tx_hash TEXT NOT NULL,
+    log_index INTEGER NOT NULL,
+    PRIMARY KEY (lottery, tx_hash, log_index)
+);
+CREATE TABLE IF NOT EXISTS payouts (
+    lottery TEXT NOT NULL,
+    round INTEGER NOT NULL,
+    winner TEXT NOT NULL,
+    amount TEXT NOT NULL,
+    randomness TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    tx_hash TEXT NOT NULL,
+    log_index INTEGER NOT NULL,
+    PRIMARY KEY (lottery, tx_hash, log_index)
+);
+CREATE INDEX IF NOT EXISTS entries_by_round ON entries (lottery, round);
+CREATE INDEX IF NOT EXISTS entries_by_player ON entries (lottery, player);
+CREATE INDEX IF NOT EXISTS payouts_by_winner ON payouts (lottery, winner);
+"""
+# wei amounts and 256 bit randomness don't fit SQLite's 64 bit integers, so those are stored as decimal/hex text
+
+ENTERED_SIGNATURE = "LotteryEntered(uint256,address,uint256,uint256)"
+PAID_SIGNATURE = "WinnerPaid(uint256,address,uint256,uint256)"
+
+
+class LotteryIndexer:
+    def __init__(
+        self,
+        lottery,
+        db_path=None,
+        start_block=None,
+        chunk_size=CHUNK_SIZE,
+        confirmations=CONFIRMATIONS,
+    ):
+        self.lottery = lottery
+        self.address = lottery.address
+        self.chunk_size = chunk_size
+        self.confirmations = confirmations
+        db_path = Path(db_path if db_path else config.get("indexer_db", INDEXER_DB))
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(db_path))
+        self.db.executescript(SCHEMA)
+        if start_block is None:
+            # the deployment transaction is known when we deployed in this session, otherwise scan from genesis
+            start_block = lottery.tx.block_number if lottery.tx else 0
+        self.start_block = start_block
+        self._events = web3.eth.contract(address=self.address, abi=lottery.abi).events
+        self._entered_topic = web3.keccak(text=ENTERED_SIGNATURE).hex()
+        self._paid_topic = web3.keccak(text=PAID_SIGNATURE).hex()
+
+    @property
+    def last_block(self):
+        row = self.db.execute(
+            "SELECT last_block FROM cursor WHERE lottery = ?", (self.address,)
+        ).fetchone()
+        return row[0] if row else self.start_block - 1
+
+    def _set_last_block(self, block_number):
+        self.db.execute(
+            "INSERT OR REPLACE INTO cursor (lottery, last_block) VALUES (?, ?)",
+            (self.address, block_number),
+        )
+
+    def _check_reorg(self):
+        # returns the block we have to roll back to, or None if our recent blocks are still on the canonical chain
+        rows = self.db.execute(
+            "SELECT block_number, block_hash FROM blocks WHERE lottery = ? ORDER BY block_number",
+            (self.address,),
+        ).fetchall()
+        for block_number, block_hash in rows:
+            try:
+                block = web3.eth.get_block(block_number)
+            except BlockNotFound:
+                # the new chain is shorter than the one we indexed, so this block is gone too
+                block = None
+            if block is None or block.hash.hex() != block_hash:
+                return max(block_number - self.confirmations, self.start_block - 1)
+        return None
+
+    def rollback(self, block_number):
+        """Deletes everything indexed above `block_number`."""
+        for table in ("entries", "payouts", "blocks"):
+            self.db.execute(
+                f"DELETE FROM {table} WHERE lottery = ? AND block_number > ?",
+                (self.address, block_number),
+            )
+        self._set_last_block(block_number)
+        self.db.commit()
+
+    def _store_log(self, log):
+        topic = log["topics"][0].hex()
+        if topic == self._entered_topic:
+            args = self._events.LotteryEntered().processLog(log).args
+            self.db.execute(
+                "INSERT OR IGNORE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.address,
+                    args.round,
+                    args.player,
+                    args.tickets,
+                    args.cumulativeTickets,
+                    log["blockNumber"],
+                    log["transactionHash"].hex(),
+                    log["logIndex"],
+                ),
+            )
+        elif topic == self._paid_topic:
+            args = self._events.WinnerPaid().processLog(log).args
+            self.db.execute(
+                "INSERT OR IGNORE INTO payouts VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.address,
+                    args.round,
+                    args.winner,
+                    str(args.amount),
+                    hex(args.randomness),
+                    log["blockNumber"],
+                    log["transactionHash"].hex(),
+                    log["logIndex"],
+                ),
+            )
+
+    def sync(self):
+        """Indexes everything from the last indexed block up to the chain head
+        in `chunk_size` block ranges. Returns the number of new logs."""
+        fork_point = self._check_reorg()
+        if fork_point is not None:
+            print(f"Reorg detected, rolling back to block {fork_point}")
+            self.rollback(fork_point)
+        head = web3.eth.block_number
+        from_block = self.last_block + 1
+        new_logs = 0
+        while from_block <= head:
+            to_block = min(from_block + self.chunk_size - 1, head)
+            logs = web3.eth.get_logs(
+                {
+                    "address": self.address,
+                    "fromBlock": from_block,
+                    "toBlock": to_block,
+                    "topics": [[self._entered_topic, self._paid_topic]],
+                }
+            )
+            for log in logs:
+                self._store_log(log)
+            new_logs += len(logs)
+            # cursor and rows are committed together, so a crash never leaves a half indexed chunk behind
+            self._set_last_block(to_block)
+            self.db.commit()
+            from_block = to_block + 1
+        self._remember_recent_blocks(head)
+        return new_logs
+
+    def _remember_recent_blocks(self, head):
+        first = max(head - self.confirmations + 1, self.start_block, 0)
+        known = {
+            row[0]
+            for row in self.db.execute(
+                "SELECT block_number FROM blocks WHERE lottery = ? AND block_number >= ?",
+                (self.address, first),
+            )
+        }
+        for block_number in range(first, head + 1):
+            if block_number not in known:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO blocks VALUES (?, ?, ?)",
+                    (
+                        self.address,
+                        block_number,
+                        web3.eth.get_block(block_number).hash.hex(),
+                    ),
+                )
+        # older blocks are final, we don't need their hashes anymore
+        self.db.execute(
+            "DELETE FROM blocks WHERE lottery = ? AND block_number < ?",
+            (self.address, first),
+        )
+        self.db.commit()
+
+    def entries_for_round(self, round):
+        return self.db.execute(
+            "SELECT player, tickets, cumulative_tickets, block_number, tx_hash FROM entries "
+            "WHERE lottery = ? AND round = ? ORDER BY block_number, log_index",
+            (self.address, round),
+        ).fetchall()
+
+    def payouts_for(self, address):
+        return [
+            (round, winner, int(amount), int(randomness, 16), block_number, tx_hash)
+            for round, winner, amount, randomness, block_number, tx_hash in self.db.execute(
+                "SELECT round, winner, amount, randomness, block_number, tx_hash FROM payouts "
+                "WHERE lottery = ? AND winner = ? ORDER BY round",
+                (self.address, str(address)),
+            )
+        ]
+
+    def close(self):
+        self.db.close()
+
+
+def main():
+    lottery = Lottery[-1]
+    indexer = LotteryIndexer(lottery)
+    new_logs = indexer.sync()
+    print(
+        f"Indexed {new_logs} new logs for {lottery.address} on {network.show_active()} "
+        f"up to block {indexer.last_block}"
+    )
+    indexer.close()
@@ -0,0 +1,224 @@
+from scripts.helpful_scripts import (
+    LOCAL_BLOCKCHAIN_ENVIRONMENTS,
+    get_account,
+    ensure_link_funded,
+    fulfill_pending_requests,
+    set_vrf_fulfill_mode,
+    wait_for_fulfillment,
+)
+from scripts.entrance_fee import get_entrance_fee
+from brownie import Lottery, accounts, chain, exceptions, network, web3
+from collections import namedtuple
+import time
+
+# Runs the lottery without an operator: every new block we ask "checkUpkeep()" whether the round is due, and if it is we
+# call "performUpkeep()", which ends a round that has been open for "roundDuration" seconds with enough players, or
+# starts the next round once the last one has been paid out. This is what the Chainlink Keepers network would do for us.
+#   brownie run scripts/lottery_keeper.py                   -> keep the current "Lottery[-1]" running until Ctrl+C
+#   brownie run scripts/lottery_keeper.py main simulate 5   -> 5 time-warped rounds on the local chain
+# Cycle and idle times are measured in block timestamps, so they mean the same thing on a time-warped local chain.
+
+POLL_INTERVAL = 1  # seconds between checks for a new block
+MAX_RETRIES = 3  # attempts per "performUpkeep()" after the first one
+RETRY_DELAY = 2  # seconds before retrying a failed "performUpkeep()"
+
+# "performData" is the "UPKEEP_ACTION" that "performUpkeep()" is going to run
+UPKEEP_NONE = 0
+UPKEEP_START = 1
+UPKEEP_END = 2
+
+KeeperReport = namedtuple(
+    "KeeperReport",
+    [
+        "rounds",  # rounds paid out while we were running
+        "mean_cycle_time",  # seconds from one round's start to the next round's start
+        "mean_idle_time",  # seconds from a payout to the next round's start
+        "cycle_times",
+        "idle_times",
+        "retries",
+        "failures",
+    ],
+)
+
+
+def _mean(values):
+    return sum(values) / len(values) if values else None
+
+
+def _block_timestamp(block_number):
+    return web3.eth.get_block(block_number).timestamp
+
+
+class LotteryKeeper:
+    def __init__(
+        self,
+        lottery=None,
+        account=None,
+        poll_interval=POLL_INTERVAL,
+        max_retries=MAX_RETRIES,
+        retry_delay=RETRY_DELAY,
+        fulfillment_timeout=None,
+    ):
+        self.lottery = lottery if lottery else Lottery[-1]
+        self.account = account if account else get_account()
+        self.poll_interval = poll_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.fulfillment_timeout = fulfillment_timeout
+        self.rounds = 0
+        self.retries = 0
+        self.failures = 0
+        self._started_at = []  # block timestamp of every round start we saw
+        self._cycle_times = []
+        self._idle_times = []
+        self._paid_at = None
+        self._funded = False
+
+    def _fund(self):
+        # "checkUpkeep()" won't end a round the contract can't pay the randomness for, so we top it up here instead of
+        # checking the LINK balance every block: once at startup and after every round we start
+        ensure_link_funded(self.lottery.address, account=self.account)
+        self._funded = True
+
+    def _perform(self, perform_data):
+        # Another keeper may beat us to it, so before every retry we ask "checkUpkeep()" again
+        for attempt in range(self.max_retries + 1):
+            try:
+                tx = self.lottery.performUpkeep(perform_data, {"from": self.account})
+                tx.wait(1)
+                return tx
+            except (ValueError, exceptions.VirtualMachineError) as error:
+                print(f"performUpkeep() failed (attempt {attempt + 1}): {error}")
+                if attempt == self.max_retries:
+                    break
+                self.retries += 1
+                time.sleep(self.retry_delay)
+                upkeep_needed, perform_data = self.lottery.checkUpkeep(b"")
+                if not upkeep_needed:
+                    return None
+        self.failures += 1
+        return None
+
+    def start_round(self, tx):
+        """Records the round started by `tx` and funds the lottery. "step()"
+        calls it for the rounds it starts, call it yourself for one started
+        elsewhere, e.g. the owner's "startLottery()" of the very first round."""
+        started_at = tx.timestamp
+        if self._started_at:
+            self._cycle_times.append(started_at - self._started_at[-1])
+        if self._paid_at is not None:
+            self._idle_times.append(started_at - self._paid_at)
+            self._paid_at = None
+        self._started_at.append(started_at)
+        print(f"Started round {self.lottery.lotteryRound()}")
+        self._fund()
+
+    def _round_ended(self, tx):
+        # locally our mock coordinator may have queued the request instead of answering it in the same block
+        fulfill_pending_requests()
+        try:
+            fulfillment = wait_for_fulfillment(
+                self.lottery, tx, timeout=self.fulfillment_timeout
+            )
+        except TimeoutError as error:
+            # the round stays in "CALCULATING_WINNER", "checkUpkeep()" picks it up again once the callback lands
+            print(error)
+            self.failures += 1
+            return
+        self.rounds += 1
+        self._paid_at = _block_timestamp(fulfillment.block_number)
+        print(f"{fulfillment.winner} is the new winner!")
+
+    def step(self):
+        """Checks the upkeep once and performs it if needed. Returns the
+        action that was performed (UPKEEP_START/UPKEEP_END) or UPKEEP_NONE."""
+        if not self._funded:
+            self._fund()
+        upkeep_needed, perform_data = self.lottery.checkUpkeep(b"")
+        if not upkeep_needed:
+            return UPKEEP_NONE
+        action = int.from_bytes(bytes(perform_data)[-32:], "big")
+        tx = self._perform(perform_data)
+        if tx is None:
+            return UPKEEP_NONE
+        if action == UPKEEP_START:
+            self.start_round(tx)
+        elif action == UPKEEP_END:
+            self._round_ended(tx)
+        return action
+
+    def run(self, max_rounds=None):
+        """Calls "step()" once per new block until `max_rounds` rounds have
+        been paid out (forever by default) or we're interrupted."""
+        last_block = None
+        try:
+            while max_rounds is None or self.rounds < max_rounds:
+                block_number = web3.eth.block_number
+                if block_number == last_block:
+                    time.sleep(self.poll_interval)
+                    continue
+                last_block = block_number
+                self.step()
+        except KeyboardInterrupt:
+            pass
+        return self.report()
+
+    def report(self):
+        return KeeperReport(
+            self.rounds,
+            _mean(self._cycle_times),
+            _mean(self._idle_times),
+            list(self._cycle_times),
+            list(self._idle_times),
+            self.retries,
+            self.failures,
+        )
+
+
+def print_report(report):
+    def seconds(value):
+        return "-" if value is None else f"{value:.1f}s"
+
+    print(f"{'rounds':<16}{report.rounds}")
+    print(f"{'mean cycle time':<16}{seconds(report.mean_cycle_time)}")
+    print(f"{'mean idle time':<16}{seconds(report.mean_idle_time)}")
+    print(f"{'retries':<16}{report.retries}")
+    print(f"{'failures':<16}{report.failures}")
+
+
+def simulate(rounds=3, lottery=None, keeper=None):
+    """Time-warping harness for the local chain: fills every round up to
+    "minPlayers", jumps "roundDuration" seconds ahead with "chain.sleep()" and
+    mines a block, and lets the keeper react to each block. The mock
+    coordinator answers in the same block, so nothing here waits on a clock.
+        Returns:
+            KeeperReport
+    """
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        raise ValueError("The time-warping harness only runs on a local chain")
+    lottery = lottery if lottery else Lottery[-1]
+    keeper = keeper if keeper else LotteryKeeper(lottery, fulfillment_timeout=5)
+    owner = get_account()
+    set_vrf_fulfill_mode("same_block")
+    if lottery.lottery_state() == 1 and lottery.lotteryRound() == 0:
+        # the owner opens the very first round, the keeper takes it from there
+        keeper.start_round(lottery.startLottery({"from": owner}))
+    while keeper.rounds < rounds:
+        if lottery.lottery_state() == 0:
+            current_round = lottery.lotteryRound()
+            fee = get_entrance_fee(lottery)
+            for i in range(lottery.entryCount(current_round), lottery.minPlayers()):
+                lottery.enter({"from": accounts[i % len(accounts)], "value": fee})
+            chain.sleep(lottery.roundDuration())
+        chain.mine()
+        if keeper.step() == UPKEEP_NONE and keeper.failures:
+            raise RuntimeError("The keeper gave up, see the errors above")
+    return keeper.report()
+
+
+def main(mode="run", rounds=None):
+    if mode == "simulate":
+        report = simulate(int(rounds) if rounds else 3)
+    else:
+        report = LotteryKeeper().run(int(rounds) if rounds else None)
+    print_report(report)
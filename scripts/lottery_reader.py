@@ -0,0 +1,67 @@
+from brownie import Lottery, multicall
+from collections import namedtuple
+
+# Reads lottery state in as few RPC round trips as possible:
+# "getRoundSummary()" replaces separate "recentWinner()", "lottery_state()", "getEntranceFee()" and "balance()" calls,
+# and the paged "getPlayers()" calls are bundled with brownie's "multicall" into one aggregated "eth_call" per batch.
+# Outside of development networks "multicall" needs the "multicall2" address in "brownie-config.yaml".
+
+PAGE_SIZE = 500  # entries per "getPlayers()" page
+PAGES_PER_CALL = 10  # pages bundled into one aggregated "eth_call"
+
+RoundSummary = namedtuple(
+    "RoundSummary",
+    [
+        "round",
+        "state",
+        "player_count",
+        "total_tickets",
+        "entrance_fee",
+        "balance",
+        "recent_winner",
+        "randomness",
+    ],
+)
+
+
+class LotteryReader:
+    def __init__(self, lottery=None, page_size=PAGE_SIZE, pages_per_call=PAGES_PER_CALL):
+        self.lottery = lottery if lottery else Lottery[-1]
+        self.page_size = page_size
+        self.pages_per_call = pages_per_call
+
+    def round_summary(self):
+        return RoundSummary(*self.lottery.getRoundSummary())
+
+    def read(self, *calls):
+        """Runs several view calls, e.g. `(lottery.entryCount, 0)`, as a single
+        aggregated eth_call and returns their results in order."""
+        with multicall():
+            results = [fn(*args) for fn, *args in calls]
+        return list(results)
+
+    def players(self, round=None):
+        """Returns [(player, cumulative_tickets), ...] for every purchase of
+        `round` (the current round by default)."""
+        if round is None:
+            round = self.lottery.lotteryRound()
+        count = self.lottery.entryCount(round)
+        offsets = list(range(0, count, self.page_size))
+        entries = []
+        for start in range(0, len(offsets), self.pages_per_call):
+            pages = self.read(
+                *[
+                    (self.lottery.getPlayers, round, offset, self.page_size)
+                    for offset in offsets[start : start + self.pages_per_call]
+                ]
+            )
+            for players, cumulative_tickets in pages:
+                entries.extend(zip(players, cumulative_tickets))
+        return entries
+
+
+def main():
+    reader = LotteryReader()
+    summary = reader.round_summary()
+    print(summary)
+    print(f"{len(reader.players(summary.round))} entries in round {summary.round}")
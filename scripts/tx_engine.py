@@ -0,0 +1,214 @@
+from brownie import exceptions, web3
+from web3.exceptions import TransactionNotFound
+from concurrent.futures import Future
+import time
+
+# A small transaction submission engine for the scripts. Instead of "tx.wait(1)" after every transaction:
+# - nonces are handed out locally, so one account can have many transactions in flight at once
+# - the gas price comes from a pluggable strategy (any callable returning wei, or None for the node's default)
+# - every submission returns a "concurrent.futures.Future" that resolves with the TransactionReceipt once confirmed,
+#   and a submission can wait on other futures ("after=[...]") instead of the script waiting serially
+# - receipts are checked once per new block for everything in flight, and a transaction that stays unmined for
+#   "stuck_after" seconds is replaced (same nonce) with a higher gas price
+#   engine = TxEngine()
+#   funded = engine.submit(link_token.transfer, lottery, amount, tx_params={"from": account})
+#   ended = engine.submit(lottery.endLottery, tx_params={"from": account}, after=[funded])
+#   engine.wait(ended)
+
+POLL_INTERVAL = 0.2
+STUCK_AFTER = 60  # seconds without a receipt before we replace a transaction
+REPLACE_INCREMENT = 1.125  # nodes want at least +10% gas price for a replacement
+
+
+class TransactionFailed(Exception):
+    pass
+
+
+class NonceTracker:
+    """Hands out nonces per account locally so we don't have to ask the node
+    before every single transaction. After a send fails before reaching the
+    mempool the account is resynced from the node's pending count."""
+
+    def __init__(self):
+        self._next_nonce = {}
+
+    def next(self, account):
+        address = account.address
+        if address not in self._next_nonce:
+            self._next_nonce[address] = web3.eth.get_transaction_count(
+                address, "pending"
+            )
+        nonce = self._next_nonce[address]
+        self._next_nonce[address] += 1
+        return nonce
+
+    def resync(self, account):
+        self._next_nonce.pop(account.address, None)
+
+
+def fixed_gas_price(wei):
+    return lambda: wei
+
+
+def node_gas_price(multiplier=1.0):
+    return lambda: int(web3.eth.gas_price * multiplier)
+
+
+def get_receipt(txid):
+    try:
+        return web3.eth.get_transaction_receipt(txid)
+    except TransactionNotFound:
+        return None
+
+
+class _Job:
+    def __init__(self, method, args, tx_params, after):
+        self.method = method
+        self.args = args
+        self.tx_params = tx_params
+        self.after = after
+        self.future = Future()
+        self.nonce = None
+        self.gas_price = None
+        self.sent_at = None
+        self.txs = {}  # txid -> TransactionReceipt, more than one once it has been replaced
+
+
+class TxEngine:
+    def __init__(
+        self,
+        gas_strategy=None,
+        required_confs=1,
+        stuck_after=STUCK_AFTER,
+        replace_increment=REPLACE_INCREMENT,
+        poll_interval=POLL_INTERVAL,
+    ):
+        self.gas_strategy = gas_strategy
+        self.required_confs = required_confs
+        self.stuck_after = stuck_after
+        self.replace_increment = replace_increment
+        self.poll_interval = poll_interval
+        self.nonces = NonceTracker()
+        self._queued = []  # waiting on their "after" futures
+        self._in_flight = []  # sent, waiting on a receipt
+        self._last_block = None
+
+    def submit(self, method, *args, tx_params=None, after=()):
+        """Queues `method(*args, tx_params)` and returns a Future for its
+        confirmed TransactionReceipt. It is sent as soon as every future in
+        `after` has resolved, and fails if any of them failed. A `method` that
+        returns None instead of sending resolves the Future with None."""
+        job = _Job(method, args, dict(tx_params or {}), list(after))
+        self._queued.append(job)
+        self._send_ready()
+        return job.future
+
+    def _send_ready(self):
+        for job in list(self._queued):
+            if not all(future.done() for future in job.after):
+                continue
+            self._queued.remove(job)
+            failed = [future for future in job.after if future.exception()]
+            if failed:
+                job.future.set_exception(
+                    TransactionFailed(f"A dependency failed: {failed[0].exception()}")
+                )
+                continue
+            self._send(job)
+
+    def _send(self, job, gas_price=None):
+        params = dict(job.tx_params)
+        account = params["from"]
+        replacing = job.nonce is not None
+        params["nonce"] = job.nonce if replacing else self.nonces.next(account)
+        if gas_price is None and self.gas_strategy is not None:
+            gas_price = self.gas_strategy()
+        if gas_price is not None:
+            params["gas_price"] = gas_price
+        params["required_confs"] = 0
+        try:
+            tx = job.method(*job.args, params)
+        except (ValueError, exceptions.VirtualMachineError) as error:
+            if replacing:
+                # the original is still pending, keep waiting on it, and give it another "stuck_after" seconds before
+                # we try again instead of retrying on every poll
+                print(f"Could not replace nonce {job.nonce}: {error}")
+                job.sent_at = time.time()
+                return
+            # never reached the mempool, so its nonce is free again
+            self.nonces.resync(account)
+            job.future.set_exception(error)
+            return
+        if tx is None:
+            # the method decided at send time that there is nothing to send (e.g. "ensure_link_funded()" found the
+            # balance already covered), so its nonce is free again
+            self.nonces.resync(account)
+            job.future.set_result(None)
+            return
+        job.nonce = params["nonce"]
+        job.gas_price = gas_price
+        job.sent_at = time.time()
+        job.txs[tx.txid] = tx
+        if not replacing:
+            self._in_flight.append(job)
+
+    def _replace(self, job):
+        current = job.gas_price if job.gas_price is not None else web3.eth.gas_price
+        print(f"Replacing stuck transaction with nonce {job.nonce}")
+        self._send(job, gas_price=int(current * self.replace_increment))
+
+    def poll(self):
+        """One pass over everything in flight: confirm what has been mined,
+        replace what is stuck, and send what has been unblocked."""
+        head = web3.eth.block_number
+        if head != self._last_block:
+            # receipts can only change with a new block, so we check them all together once per block
+            self._last_block = head
+            for job in list(self._in_flight):
+                receipt = None
+                for txid in job.txs:
+                    receipt = get_receipt(txid)
+                    if receipt is not None:
+                        break
+                if receipt is None:
+                    continue
+                if head - receipt.blockNumber + 1 < self.required_confs:
+                    continue
+                self._in_flight.remove(job)
+                if receipt.status == 1:
+                    # brownie fills its receipt in from its own confirmation thread, which may not have caught up with
+                    # the node yet, so callers could see no "status", "block_number" or "events" without this
+                    tx = job.txs[txid]
+                    tx.wait(self.required_confs)
+                    job.future.set_result(tx)
+                else:
+                    job.future.set_exception(
+                        TransactionFailed(f"Transaction {txid} reverted")
+                    )
+        now = time.time()
+        for job in self._in_flight:
+            if now - job.sent_at > self.stuck_after:
+                self._replace(job)
+        self._send_ready()
+
+    def wait(self, futures, timeout=None):
+        """Polls until `futures` (one Future or a list) have resolved and
+        returns their results, raising the first failure."""
+        single = isinstance(futures, Future)
+        futures = [futures] if single else list(futures)
+        deadline = time.time() + timeout if timeout is not None else None
+        while not all(future.done() for future in futures):
+            if not self._in_flight and not self._queued:
+                raise TransactionFailed("Waiting on a future this engine will never resolve")
+            if deadline is not None and time.time() > deadline:
+                raise TimeoutError(f"Transactions not confirmed after {timeout} seconds")
+            self.poll()
+            if not all(future.done() for future in futures):
+                time.sleep(self.poll_interval)
+        results = [future.result() for future in futures]
+        return results[0] if single else results
+
+    def flush(self, timeout=None):
+        """Waits for everything submitted so far."""
+        futures = [job.future for job in self._queued + self._in_flight]
+        return self.wait(futures, timeout) if futures else []
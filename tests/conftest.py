@@ -0,0 +1,33 @@
+"""
+Shared fixtures for the "Lottery" tests.
+
+Instead of every test calling "deploy_lottery()" (and deploying the mocks again) we deploy once per session,
+take a chain snapshot, and revert to it after every test, so each test still starts from a freshly deployed lottery.
+With "pytest-xdist" installed, "brownie test -n auto" runs the suite in parallel, and brownie gives every worker
+its own local chain on its own port (8545 + worker number), so each worker pays for this deployment once.
+"""
+
+import pytest
+from brownie import chain, network
+from scripts.helpful_scripts import LOCAL_BLOCKCHAIN_ENVIRONMENTS
+from scripts.deploy_lottery import deploy_lottery
+from scripts import deployment_registry, entrance_fee
+
+
+@pytest.fixture(scope="session")
+def deployed_lottery():
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip("unit tests only run on a local chain")
+    lottery = deploy_lottery()
+    chain.snapshot()
+    return lottery
+
+
+@pytest.fixture
+def lottery(deployed_lottery):
+    yield deployed_lottery
+    # "revert()" also takes a new snapshot, so the next test starts from the same state
+    chain.revert()
+    # the in-process caches would otherwise outlive the revert, e.g. an entrance fee quoted after a test moved the feed
+    deployment_registry.clear_cache()
+    entrance_fee.clear_cache()
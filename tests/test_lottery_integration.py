@@ -8,14 +8,25 @@ from scripts.helpful_scripts import (
     LOCAL_BLOCKCHAIN_ENVIRONMENTS,
     get_account,
     fund_with_link,
+    wait_for_fulfillment,
+    set_vrf_fulfill_mode,
 )
 from scripts.deploy_lottery import deploy_lottery
-import time
 
 
-def test_can_pick_winner():
-    if network.show_active() in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
-        pytest.skip()
+@pytest.fixture
+def vrf_node():
+    # On a "Test Net" the `Chainlink Node` answers for us. Locally our "VRFCoordinatorMock" plays the node and answers
+    # inside the "endLottery()" transaction, and we switch it back afterwards because the unit tests answer by hand.
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        yield
+        return
+    set_vrf_fulfill_mode("same_block")
+    yield
+    set_vrf_fulfill_mode("manual")
+
+
+def test_can_pick_winner(vrf_node):
     lottery = deploy_lottery()
     account = get_account()
     lottery.startLottery({"from": account})
@@ -23,7 +34,7 @@ def test_can_pick_winner():
     lottery.enter({"from": account, "value": lottery.getEntranceFee()})
     # we can add above +100 or +1000 in with "lottery.getEntranceFee() + 100}" as shown...
     fund_with_link(lottery)
-    lottery.endLottery({"from": account})
+    transaction = lottery.endLottery({"from": account})
     # here it could be little bit different from our "Unit Test/ test_lottery_unit.py" because in that we pretended that we were the "VRFCoordinator"
     # and we called the callBackWithRandomness() as we were a "Chainlink Node" as shown below:-
     """
@@ -31,8 +42,9 @@ def test_can_pick_winner():
         request_id, STATIC_RNG, lottery.address, {"from": account}
     )
     """
-    # but here we're on an actual network so we're actually just going to wait for that Chainlink Node to respond so for simplicity we just do as shown in below code...
-    time.sleep(60)
+    # but here we just wait for the Chainlink Node (or the auto fulfilling mock on a local chain) to respond, matching its callback against our "requestId"...
+    fulfillment = wait_for_fulfillment(lottery, transaction)
+    assert fulfillment.winner == account
     assert lottery.recentWinner() == account
     assert lottery.balance() == 0
 
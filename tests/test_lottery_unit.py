@@ -9,13 +9,38 @@ While writing `Unit Tests` we really want to test hypothetically every single li
 
 from scripts.helpful_scripts import (
     LOCAL_BLOCKCHAIN_ENVIRONMENTS,
+    PERSISTENT_LOCAL_ENVIRONMENTS,
     get_account,
     fund_with_link,
     get_contract,
+    wait_for_fulfillment,
+    wait_for_fulfillments,
+    ensure_link_funded,
+    link_funding_metrics,
+    set_vrf_fulfill_mode,
+    fulfill_pending_requests,
 )
 
-from brownie import Lottery, accounts, config, network, exceptions
-from scripts.deploy_lottery import deploy_lottery  # importing `deploy_lottery()`
+from brownie import Lottery, LinkToken, accounts, chain, config, network, exceptions, web3
+from scripts.bulk_entry import bulk_enter_lottery, percentile
+from scripts.entrance_fee import EntranceFeeCache
+from scripts.benchmark_lottery import GETTERS, compare, gas_report, run_benchmarks
+from scripts.lottery_indexer import LotteryIndexer
+from scripts.lottery_reader import LotteryReader
+from scripts.lottery_keeper import simulate
+from scripts.fairness_audit import AddressBook, audit, indexed_batches, synthetic_batches
+from scripts.instrumentation import instrument
+from scripts import deploy_lottery as deploy_lottery_script, helpful_scripts
+from scripts.tx_engine import TxEngine
+from scripts.deploy_lottery import (
+    BatchesFailed,
+    deploy_lottery_manager,
+    create_lotteries,
+    start_lotteries,
+    end_lotteries,
+    enter_lottery_by_id,
+)
+from scripts.deployment_registry import clear_cache, load_contract
 from web3 import Web3
 import pytest
 
@@ -37,12 +62,12 @@ import pytest
 """
 
 
-def test_get_entrance_fee():
+def test_get_entrance_fee(lottery):
     # Since, this is a `Unit Test` we only want to run this when we're working on a `LOCAL_BLOCKCHAIN_ENVIRONMENTS` or `LOCAL_DEVELOPMENT_NETWORKS`
     if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
         pytest.skip()
     # Arrange
-    lottery = deploy_lottery()
+    # "lottery" is a fixture from "conftest.py", deployed once per session and reverted after every test
     # Act
     # 2,000 eth / usd feed
     # usdEntryFee is 50
@@ -57,11 +82,10 @@ def test_get_entrance_fee():
 # After including `LOCAL_BLOCKCHAIN_ENVIRONMENTS` for testing code till here we will run "brownie test -k test_get_entrance_fee --network rinkeby" then it should go ahead and skip this.
 
 
-def test_cant_enter_unless_started():
+def test_cant_enter_unless_started(lottery):
     # Arrange
     if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
         pytest.skip()
-    lottery = deploy_lottery()
     # Act / Assert
     with pytest.raises(exceptions.VirtualMachineError):
         lottery.enter({"from": get_account(), "value": lottery.getEntranceFee()})
@@ -70,17 +94,16 @@ def test_cant_enter_unless_started():
 # Now for testing till here, we will run "brownie test -k test_cant_enter_unless_started" and this passing as well.
 
 
-def test_can_start_and_enter_lottery():
+def test_can_start_and_enter_lottery(lottery):
     # Arrange
     if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
         pytest.skip()
-    lottery = deploy_lottery()
     account = get_account()
     lottery.startLottery({"from": account})
     # Act
     lottery.enter({"from": account, "value": lottery.getEntranceFee()})
     # Assert
-    assert lottery.players(0) == account
+    assert lottery.players(lottery.lotteryRound(), 0) == account
     # because we have our players array in "address payable[] public players;" in "contract Lottery is VRFConsumerBase, Ownable {...}" at "Lottery.sol"
     # and we're going to assert that we're pushing them onto our array correctly.
 
@@ -88,11 +111,10 @@ def test_can_start_and_enter_lottery():
 # Now for testing till here, we will run "brownie test -k test_can_start_and_enter_lottery" and this passing as well.
 
 
-def test_can_end_lottery():
+def test_can_end_lottery(lottery):
     # Arrange
     if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
         pytest.skip()
-    lottery = deploy_lottery()
     account = get_account()
     lottery.startLottery({"from": account})
     lottery.enter({"from": account, "value": lottery.getEntranceFee()})
@@ -115,11 +137,10 @@ def test_can_end_lottery():
 # 2. does it corectly `pay` a winner ?
 # 3. does it corectly `reset` ?
 # This "Unit Test" is drastically close to being an "Integration Test" but as we said we'll be little loose with the definitions here...
-def test_can_pick_winner_correctly():
+def test_can_pick_winner_correctly(lottery):
     # Arrange
     if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
         pytest.skip()
-    lottery = deploy_lottery()
     account = get_account()
     lottery.startLottery({"from": account})
     lottery.enter({"from": account, "value": lottery.getEntranceFee()})
@@ -186,3 +207,629 @@ def test_can_pick_winner_correctly():
 
 # Now for testing till here, we will run "brownie test -k test_can_pick_winner_correctly" and this passing as well.
 # Now lets move to our "test_lottery_integration.py" so that we can run the contract on actual chain....
+
+
+def test_wait_for_fulfillment_matches_request_id(lottery):
+    # Arrange
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip()
+    account = get_account()
+    lottery.startLottery({"from": account})
+    lottery.enter({"from": account, "value": lottery.getEntranceFee()})
+    lottery.enter({"from": get_account(index=1), "value": lottery.getEntranceFee()})
+    fund_with_link(lottery)
+    transaction = lottery.endLottery({"from": account})
+    request_id = transaction.events["RequestedRandomness"]["requestId"]
+    STATIC_RNG = 777
+    callback = get_contract("vrf_coordinator").callBackWithRandomness(
+        request_id, STATIC_RNG, lottery.address, {"from": account}
+    )
+    # Act
+    fulfillment = wait_for_fulfillment(lottery, transaction, timeout=5)
+    # Assert
+    # 777 % 2 = 1
+    assert fulfillment.winner == get_account(index=1)
+    assert fulfillment.randomness == STATIC_RNG
+    assert fulfillment.block_number == callback.block_number
+
+
+def test_bulk_enter_lottery(lottery):
+    # Arrange
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip()
+    account = get_account()
+    lottery.startLottery({"from": account})
+    entrants = [get_account(index=i) for i in range(1, 4)]
+    # Act
+    report = bulk_enter_lottery(lottery, entrants, entries_per_account=2)
+    # Assert
+    assert report.succeeded == 6
+    assert report.failed == 0
+    assert report.latency_percentiles[50] is not None
+    assert sorted(lottery.players(0, i) for i in range(6)) == sorted(entrants * 2)
+
+
+def test_can_buy_multiple_tickets_in_one_entry(lottery):
+    # Arrange
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip()
+    account = get_account()
+    lottery.startLottery({"from": account})
+    # Act
+    lottery.enter({"from": account, "value": lottery.getEntranceFee()})
+    lottery.enterTickets(
+        50, {"from": get_account(index=1), "value": lottery.getEntranceFee() * 50}
+    )
+    lottery.enterTickets(
+        3, {"from": get_account(index=2), "value": lottery.getEntranceFee() * 3}
+    )
+    # Assert
+    assert lottery.getTotalTickets(0) == 54
+    assert lottery.entries(0, 1) == (get_account(index=1), 51)
+    assert lottery.players(0, 2) == get_account(index=2)
+    with pytest.raises(exceptions.VirtualMachineError):
+        lottery.enterTickets(
+            2, {"from": account, "value": lottery.getEntranceFee()}
+        )
+    fund_with_link(lottery)
+    transaction = lottery.endLottery({"from": account})
+    request_id = transaction.events["RequestedRandomness"]["requestId"]
+    # tickets 0 -> account, 1..50 -> account 1, 51..53 -> account 2, so 106 % 54 = 52 belongs to account 2
+    get_contract("vrf_coordinator").callBackWithRandomness(
+        request_id, 106, lottery.address, {"from": account}
+    )
+    assert lottery.recentWinner() == get_account(index=2)
+
+
+def test_closing_a_round_keeps_its_entries_readable(lottery):
+    # Arrange
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip()
+    account = get_account()
+    lottery.startLottery({"from": account})
+    lottery.enter({"from": account, "value": lottery.getEntranceFee()})
+    lottery.enter({"from": get_account(index=1), "value": lottery.getEntranceFee()})
+    fund_with_link(lottery)
+    transaction = lottery.endLottery({"from": account})
+    request_id = transaction.events["RequestedRandomness"]["requestId"]
+    # Act
+    get_contract("vrf_coordinator").callBackWithRandomness(
+        request_id, 777, lottery.address, {"from": account}
+    )
+    # Assert
+    assert lottery.lotteryRound() == 1
+    assert lottery.entryCount(1) == 0
+    assert lottery.entryCount(0) == 2
+    assert lottery.players(0, 1) == get_account(index=1)
+    lottery.startLottery({"from": account})
+    lottery.enter({"from": get_account(index=2), "value": lottery.getEntranceFee()})
+    assert lottery.players(1, 0) == get_account(index=2)
+    assert lottery.players(0, 0) == account
+
+
+def test_entrance_fee_is_cached_per_price_feed_round(lottery):
+    # Arrange
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip()
+    account = get_account()
+    price_feed = get_contract("eth_usd_price_feed")
+    lottery.startLottery({"from": account})
+    lottery.enter({"from": account, "value": lottery.getEntranceFee()})
+    assert lottery.cachedEntranceFee() == Web3.toWei(0.025, "ether")
+    # Act
+    # ETH doubles to $4,000 but within "feeCacheTtl" we keep charging the cached fee
+    price_feed.updateAnswer(400000000000, {"from": account})
+    assert lottery.getEntranceFee() == Web3.toWei(0.025, "ether")
+    chain.sleep(lottery.feeCacheTtl() + 1)
+    chain.mine()
+    # Assert
+    assert lottery.getEntranceFee() == Web3.toWei(0.0125, "ether")
+    lottery.enter({"from": account, "value": Web3.toWei(0.0125, "ether")})
+    assert lottery.cachedEntranceFee() == Web3.toWei(0.0125, "ether")
+
+
+def test_client_fee_quote_follows_the_contract_cache(lottery):
+    # Arrange
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip()
+    account = get_account()
+    price_feed = get_contract("eth_usd_price_feed")
+    lottery.startLottery({"from": account})
+    lottery.enter({"from": account, "value": lottery.getEntranceFee()})
+    # "ttl=0" so every call goes past our own TTL and only the contract's cache state decides
+    fee_cache = EntranceFeeCache(lottery, ttl=0)
+    # Act
+    # the feed moves on inside "feeCacheTtl": the contract, and so our quote, stays on the old fee
+    price_feed.updateAnswer(400000000000, {"from": account})
+    assert fee_cache.get() == Web3.toWei(0.025, "ether")
+    chain.sleep(lottery.feeCacheTtl() + 1)
+    chain.mine()
+    # Assert
+    # same feed round as our quote, but the contract's TTL ran out and it charges the new fee now
+    assert fee_cache.get() == Web3.toWei(0.0125, "ether")
+    lottery.enter({"from": account, "value": fee_cache.get()})
+
+
+def test_registry_only_persists_mocks_of_persistent_chains(lottery, tmp_path, monkeypatch):
+    # Arrange
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip()
+    registry_path = tmp_path / "deployment_registry.json"
+    monkeypatch.setattr("scripts.deployment_registry.REGISTRY_PATH", str(registry_path))
+    persistent = network.show_active() in PERSISTENT_LOCAL_ENVIRONMENTS
+    # Act
+    helpful_scripts.deploy_mocks()
+    link_token = get_contract("link_token")
+    clear_cache()
+    # with the in-process cache gone this can only come back from the on-disk registry, after a code hash check
+    reloaded = load_contract("link_token", LinkToken)
+    # Assert
+    assert registry_path.exists() == persistent
+    if persistent:
+        assert reloaded.address == link_token.address
+        assert get_contract("link_token") is reloaded
+    else:
+        assert reloaded is None
+        # still the mock we just deployed, straight from "LinkToken[-1]"
+        assert get_contract("link_token").address == link_token.address
+
+
+def test_benchmark_measures_every_getter(lottery):
+    # Arrange
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip()
+    # Act
+    report = run_benchmarks((1,))
+    # Assert
+    for operation in GETTERS + ("enter", "endLottery", "callBackWithRandomness"):
+        assert report["1"][operation]["gas"] > 0
+
+
+def test_percentile_uses_nearest_rank():
+    # Arrange
+    five, six, seven = [1, 2, 3, 4, 5], [1, 2, 3, 4, 5, 6], [1, 2, 3, 4, 5, 6, 7]
+    # Act
+    median = percentile(five, 50)
+    p90s = (percentile(six, 90), percentile(seven, 90))
+    # Assert
+    assert median == 3
+    # ceil(0.9 * 6) = 6th and ceil(0.9 * 7) = 7th value
+    assert p90s == (6, 7)
+    assert percentile(list(range(1, 101)), 99) == 99
+    assert percentile([1, 2, 3], 0) == 1
+    assert percentile([], 50) is None
+
+
+def test_benchmark_compare_flags_regressions():
+    # Arrange
+    baseline = {"10": {"enter": {"gas": 50000, "seconds": 0.02}}}
+    report = {"10": {"enter": {"gas": 60000, "seconds": 0.021}}}
+    # Act
+    regressions = compare(report, baseline)
+    # Assert
+    assert regressions == ["10 players enter gas: 50000 -> 60000"]
+    assert compare(baseline, baseline) == []
+    assert gas_report(report, baseline) == ["10 players enter: 50000 -> 60000 (+20.0%)"]
+
+
+def test_indexer_streams_entries_and_payouts(lottery, tmp_path):
+    # Arrange
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip()
+    account = get_account()
+    lottery.startLottery({"from": account})
+    lottery.enter({"from": account, "value": lottery.getEntranceFee()})
+    lottery.enterTickets(
+        2, {"from": get_account(index=1), "value": lottery.getEntranceFee() * 2}
+    )
+    fund_with_link(lottery)
+    transaction = lottery.endLottery({"from": account})
+    request_id = transaction.events["RequestedRandomness"]["requestId"]
+    # 778 % 3 = 1 -> second purchase
+    get_contract("vrf_coordinator").callBackWithRandomness(
+        request_id, 778, lottery.address, {"from": account}
+    )
+    indexer = LotteryIndexer(lottery, db_path=tmp_path / "index.sqlite")
+    # Act
+    new_logs = indexer.sync()
+    # Assert
+    assert new_logs == 3
+    entries = indexer.entries_for_round(0)
+    assert [(player, tickets) for player, tickets, *_ in entries] == [
+        (account.address, 1),
+        (get_account(index=1).address, 2),
+    ]
+    payouts = indexer.payouts_for(get_account(index=1))
+    assert len(payouts) == 1
+    assert payouts[0][3] == 778
+    # a second sync resumes from the last indexed block
+    assert indexer.sync() == 0
+    indexer.close()
+
+
+def test_indexer_rolls_back_a_reorg(lottery, tmp_path):
+    # Arrange
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip()
+    account = get_account()
+    lottery.startLottery({"from": account})
+    lottery.enter({"from": account, "value": lottery.getEntranceFee()})
+    lottery.enter({"from": get_account(index=1), "value": lottery.getEntranceFee()})
+    indexer = LotteryIndexer(lottery, db_path=tmp_path / "index.sqlite")
+    assert indexer.sync() == 2
+    # Act
+    # the chain goes back below our head, so the last block we indexed doesn't exist anymore
+    chain.undo()
+    indexer.sync()
+    players_after_undo = [player for player, *_ in indexer.entries_for_round(0)]
+    # ...and a different block takes its place
+    lottery.enter({"from": get_account(index=2), "value": lottery.getEntranceFee()})
+    indexer.sync()
+    # Assert
+    assert players_after_undo == [account.address]
+    assert [player for player, *_ in indexer.entries_for_round(0)] == [
+        account.address,
+        get_account(index=2).address,
+    ]
+    indexer.close()
+
+
+def test_reader_pages_players_and_summarizes_round(lottery):
+    # Arrange
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip()
+    account = get_account()
+    lottery.startLottery({"from": account})
+    for index in range(5):
+        lottery.enterTickets(
+            index + 1,
+            {"from": get_account(index=index), "value": lottery.getEntranceFee() * 5},
+        )
+    reader = LotteryReader(lottery, page_size=2, pages_per_call=2)
+    # Act
+    players = reader.players()
+    summary = reader.round_summary()
+    # Assert
+    assert players == [
+        (get_account(index=i).address, sum(range(1, i + 2))) for i in range(5)
+    ]
+    assert summary.player_count == 5
+    assert summary.total_tickets == 15
+    assert summary.state == 0
+    assert summary.balance == lottery.balance()
+    assert lottery.getPlayers(0, 4, 10) == ([get_account(index=4).address], [15])
+    assert lottery.getPlayers(0, 5, 10) == ([], [])
+
+
+def test_manager_routes_fulfillments_to_the_right_lottery(lottery):
+    # Arrange
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip()
+    account = get_account()
+    manager = deploy_lottery_manager()
+    lottery_ids = create_lotteries(3, manager=manager)
+    start_lotteries(lottery_ids, manager=manager)
+    for lottery_id in lottery_ids:
+        enter_lottery_by_id(lottery_id, account=get_account(index=lottery_id + 1), manager=manager)
+    enter_lottery_by_id(1, tickets=3, account=get_account(index=5), manager=manager)
+    fund_with_link(manager, amount=config["networks"][network.show_active()]["fee"] * 3)
+    transaction = manager.endLotteries(lottery_ids, {"from": account})
+    requests = {
+        event["lotteryId"]: event["requestId"]
+        for event in transaction.events["RequestedRandomness"]
+    }
+    # Act
+    # answer the requests out of order, each one must still land in its own lottery
+    for lottery_id in (2, 0, 1):
+        get_contract("vrf_coordinator").callBackWithRandomness(
+            requests[lottery_id], 1001, manager.address, {"from": account}
+        )
+    fulfillments = wait_for_fulfillments(
+        manager, list(requests.values()), transaction.block_number, timeout=5
+    )
+    # Assert
+    assert len(fulfillments) == 3
+    assert manager.lotteries(0)["recentWinner"] == get_account(index=1)
+    assert manager.lotteries(2)["recentWinner"] == get_account(index=3)
+    # lottery 1 sold 4 tickets, 1001 % 4 = 1 -> the 3 ticket purchase
+    assert manager.lotteries(1)["recentWinner"] == get_account(index=5)
+    assert manager.lotteries(1)["round"] == 1
+    assert manager.lotteries(1)["pot"] == 0
+    assert manager.balance() == 0
+
+
+def test_end_lotteries_keeps_the_batches_that_went_through(lottery, monkeypatch):
+    # Arrange
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip()
+    monkeypatch.setattr("scripts.deploy_lottery.MANAGER_BATCH_SIZE", 1)
+    set_vrf_fulfill_mode("same_block")
+    manager = deploy_lottery_manager()
+    assert create_lotteries(0, manager=manager) == []
+    lottery_ids = create_lotteries(2, manager=manager)
+    start_lotteries(lottery_ids, manager=manager)
+    # nobody enters lottery 1, so its batch reverts
+    enter_lottery_by_id(0, account=get_account(index=1), manager=manager)
+    # Act
+    with pytest.raises(BatchesFailed) as failure:
+        end_lotteries(lottery_ids, manager=manager, timeout=5)
+    # Assert
+    assert len(failure.value.transactions) == 1
+    assert failure.value.results[0].winner == get_account(index=1)
+    assert manager.lotteries(0)["recentWinner"] == get_account(index=1)
+    assert manager.lotteries(1)["state"] == 0
+
+
+def test_tx_engine_chains_dependent_transactions(lottery):
+    # Arrange
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip()
+    account = get_account()
+    engine = TxEngine()
+    # Act
+    started = engine.submit(lottery.startLottery, tx_params={"from": account})
+    entered = engine.submit(
+        lottery.enter,
+        tx_params={"from": get_account(index=1), "value": lottery.getEntranceFee()},
+        after=[started],
+    )
+    # the funding doesn't depend on anything, so it goes out right away next to "startLottery()"
+    funded = fund_with_link(lottery, engine=engine)
+    ended = engine.submit(
+        lottery.endLottery, tx_params={"from": account}, after=[entered, funded]
+    )
+    transaction = engine.wait(ended)
+    # Assert
+    assert transaction.status == 1
+    assert lottery.lottery_state() == 2
+    assert funded.result().nonce == started.result().nonce + 1
+    assert entered.result().block_number >= started.result().block_number
+
+
+def test_ensure_link_funded_only_tops_up_when_short(lottery):
+    # Arrange
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip()
+    fee = lottery.fee()
+    link_token = get_contract("link_token")
+    checks = link_funding_metrics["checks"]
+    transfers = link_funding_metrics["transfers"]
+    # Act
+    first = ensure_link_funded(lottery.address, rounds=3)
+    second = ensure_link_funded(lottery.address, rounds=3)
+    # Assert
+    assert first is not None
+    assert second is None
+    assert link_token.balanceOf(lottery) == fee * 3
+    assert link_funding_metrics["checks"] == checks + 2
+    assert link_funding_metrics["transfers"] == transfers + 1
+
+
+def test_ensure_link_funded_checks_the_balance_when_the_engine_sends(lottery):
+    # Arrange
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip()
+    account = get_account()
+    fee = lottery.fee()
+    link_token = get_contract("link_token")
+    engine = TxEngine()
+    lottery.startLottery({"from": account})
+    lottery.enter({"from": account, "value": lottery.getEntranceFee()})
+    ensure_link_funded(lottery.address, rounds=1)
+    # Act
+    # checked at submit time this would see the fee still there and skip the top-up "endLottery()" is about to need
+    ended = engine.submit(lottery.endLottery, tx_params={"from": account})
+    funded = ensure_link_funded(lottery.address, rounds=1, engine=engine, after=[ended])
+    # nothing in between confirms, so this one must not send the same top-up again
+    funded_again = ensure_link_funded(lottery.address, rounds=1, engine=engine, after=[ended])
+    engine.wait([ended, funded, funded_again])
+    # Assert
+    assert funded.result() is not None
+    assert funded_again.result() is None
+    assert link_token.balanceOf(lottery) == fee
+
+
+def test_auto_fulfilling_mock_answers_in_the_request_transaction(lottery):
+    # Arrange
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip()
+    account = get_account()
+    vrf_coordinator = get_contract("vrf_coordinator")
+    set_vrf_fulfill_mode("same_block", seed=42)
+    lottery.startLottery({"from": account})
+    lottery.enter({"from": account, "value": lottery.getEntranceFee()})
+    lottery.enter({"from": get_account(index=1), "value": lottery.getEntranceFee()})
+    fund_with_link(lottery)
+    # Act
+    transaction = lottery.endLottery({"from": account})
+    # Assert
+    request_id = transaction.events["RequestedRandomness"]["requestId"]
+    randomness = vrf_coordinator.randomnessFor(request_id)
+    assert transaction.events["RandomnessFulfilled"]["requestId"] == request_id
+    assert lottery.randomness() == randomness
+    assert lottery.recentWinner() == get_account(index=randomness % 2)
+    assert lottery.lottery_state() == 1
+    assert vrf_coordinator.pendingRequestCount() == 0
+
+
+def test_auto_fulfilling_mock_queues_what_it_cant_answer_right_away(lottery):
+    # Arrange
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip()
+    account = get_account()
+    vrf_coordinator = get_contract("vrf_coordinator")
+    set_vrf_fulfill_mode("same_block")
+    manager = deploy_lottery_manager()
+    lottery_ids = create_lotteries(2, manager=manager)
+    start_lotteries(lottery_ids, manager=manager)
+    for lottery_id in lottery_ids:
+        enter_lottery_by_id(lottery_id, account=get_account(index=lottery_id + 1), manager=manager)
+    fund_with_link(manager, amount=config["networks"][network.show_active()]["fee"] * 2)
+    # Act
+    # the manager maps its requestIds after "requestRandomness()" returns, so the same block callbacks fail and get queued
+    transaction = manager.endLotteries(lottery_ids, {"from": account})
+    queued = vrf_coordinator.pendingRequestCount()
+    fulfill_pending_requests()
+    # Assert
+    assert queued == 2
+    assert vrf_coordinator.pendingRequestCount() == 0
+    assert manager.lotteries(0)["recentWinner"] == get_account(index=1)
+    assert manager.lotteries(1)["recentWinner"] == get_account(index=2)
+    assert transaction.events["RequestedRandomness"][0]["requestId"] != (
+        transaction.events["RequestedRandomness"][1]["requestId"]
+    )
+
+
+def test_round_state_is_packed_into_one_slot(lottery):
+    # Arrange
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip()
+    account = get_account()
+    lottery.startLottery({"from": account})
+    lottery.enter({"from": get_account(index=1), "value": lottery.getEntranceFee()})
+    fund_with_link(lottery)
+    transaction = lottery.endLottery({"from": account})
+    request_id = transaction.events["RequestedRandomness"]["requestId"]
+    # Act
+    get_contract("vrf_coordinator").callBackWithRandomness(
+        request_id, 777, lottery.address, {"from": account}
+    )
+    # Assert
+    # slot 0 is "VRFConsumerBase.nonces", slot 1 is "Ownable._owner", then recentWinner | lottery_state | round | roundStartedAt
+    slot = int.from_bytes(web3.eth.get_storage_at(lottery.address, 2), "big")
+    assert slot & (2**160 - 1) == int(get_account(index=1).address, 16)
+    assert (slot >> 160) & 0xFF == lottery.lottery_state() == 1
+    assert (slot >> 168) & (2**48 - 1) == lottery.lotteryRound() == 1
+    assert slot >> 216 == lottery.roundStartedAt()
+
+
+def test_upkeep_waits_for_round_duration_and_players(lottery):
+    # Arrange
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip()
+    account = get_account()
+    lottery.startLottery({"from": account})
+    fund_with_link(lottery)
+    lottery.enter({"from": account, "value": lottery.getEntranceFee()})
+    chain.sleep(lottery.roundDuration())
+    chain.mine()
+    # Act / Assert
+    # the round is due but only has 1 of its "minPlayers"
+    assert lottery.checkUpkeep(b"")[0] is False
+    with pytest.raises(exceptions.VirtualMachineError):
+        lottery.performUpkeep(b"", {"from": get_account(index=1)})
+    lottery.enter({"from": get_account(index=1), "value": lottery.getEntranceFee()})
+    upkeep_needed, perform_data = lottery.checkUpkeep(b"")
+    assert upkeep_needed is True
+    # anybody (usually a keeper) can perform the upkeep, not just the owner
+    lottery.performUpkeep(perform_data, {"from": get_account(index=2)})
+    assert lottery.lottery_state() == 2
+
+
+def test_keeper_runs_rounds_back_to_back(lottery):
+    # Arrange
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip()
+    # Act
+    report = simulate(2, lottery)
+    # Assert
+    assert report.rounds == 2
+    assert report.failures == 0
+    assert lottery.lotteryRound() == 2
+    assert len(report.cycle_times) == 1
+    assert report.mean_cycle_time >= lottery.roundDuration()
+    # the next round starts a block after the payout instead of whenever an operator notices
+    assert report.idle_times[0] < lottery.roundDuration()
+    assert lottery.checkUpkeep(b"")[0] is True
+
+
+def test_fairness_audit_replays_indexed_rounds(lottery, tmp_path):
+    # Arrange
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip()
+    account = get_account()
+    lottery.startLottery({"from": account})
+    lottery.enter({"from": account, "value": lottery.getEntranceFee()})
+    lottery.enterTickets(
+        3, {"from": get_account(index=1), "value": lottery.getEntranceFee() * 3}
+    )
+    fund_with_link(lottery)
+    transaction = lottery.endLottery({"from": account})
+    request_id = transaction.events["RequestedRandomness"]["requestId"]
+    get_contract("vrf_coordinator").callBackWithRandomness(
+        request_id, 2**255 + 1, lottery.address, {"from": account}
+    )
+    db_path = tmp_path / "index.sqlite"
+    indexer = LotteryIndexer(lottery, db_path=db_path)
+    indexer.sync()
+    indexer.close()
+    book = AddressBook()
+    # Act
+    report = audit(indexed_batches(lottery.address, book, db_path=db_path), book, use_numpy=False)
+    # Assert
+    assert report.rounds == report.checked == 1
+    assert report.mismatch_count == 0
+    assert report.max_total_tickets == 4
+    stats = {s.address: s for s in report.addresses}
+    assert stats[get_account(index=1).address].expected_wins == 0.75
+    assert stats[lottery.recentWinner()].wins == 1
+
+
+def test_fairness_audit_numpy_matches_python():
+    pytest.importorskip("numpy")
+    book = AddressBook()
+    batches = list(synthetic_batches(5000, book, players=7, max_tickets=9, batch_rounds=1000))
+    # Act
+    vectorized = audit(iter(batches), book, use_numpy=True)
+    plain = audit(iter(batches), book, use_numpy=False)
+    # Assert
+    assert vectorized.rounds == plain.rounds == 5000
+    assert sorted((s.address, s.wins, s.tickets) for s in vectorized.addresses) == sorted(
+        (s.address, s.wins, s.tickets) for s in plain.addresses
+    )
+
+
+def test_instrumentation_traces_steps_and_rpc_calls(lottery, tmp_path):
+    # Arrange
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip()
+    original = helpful_scripts.fund_with_link
+    tracer = instrument(tmp_path / "trace.jsonl")
+    # Act
+    try:
+        helpful_scripts.fund_with_link(lottery)
+    finally:
+        tracer.uninstall()
+    # Assert
+    steps = {record["step"]: record for record in tracer.records}
+    funding = steps["fund_with_link"]
+    assert funding["transactions"] == 1
+    assert funding["gas_used"] > 0
+    assert funding["blocks_waited"] == 1
+    assert sum(funding["rpc_calls"].values()) > 0
+    assert steps["tx.wait"]["parent"] == "fund_with_link"
+    assert "fund_with_link" in dict(tracer.summary())
+    assert len((tmp_path / "trace.jsonl").read_text().splitlines()) == len(tracer.records)
+    # everything is unwrapped again
+    assert helpful_scripts.fund_with_link is original
+
+
+def test_instrumentation_charges_engine_transactions_to_their_step(lottery, tmp_path):
+    # Arrange
+    if network.show_active() not in LOCAL_BLOCKCHAIN_ENVIRONMENTS:
+        pytest.skip()
+    tracer = instrument(tmp_path / "trace.jsonl")
+    engine = TxEngine()
+    # Act
+    try:
+        # "start_lottery()" only submits and returns, the transaction is sent and confirmed inside "TxEngine.wait()"
+        started = deploy_lottery_script.start_lottery(engine)
+        engine.wait(started)
+    finally:
+        tracer.uninstall()
+    # Assert
+    steps = {record["step"]: record for record in tracer.records}
+    assert steps["start_lottery"]["transactions"] == 1
+    assert steps["start_lottery"]["gas_used"] == started.result().gas_used > 0
+    assert steps["start_lottery"]["blocks_waited"] >= 1
+    assert steps["TxEngine.wait"]["gas_used"] == started.result().gas_used